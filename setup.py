@@ -16,9 +16,15 @@ setup(name='tap-timebutler',
           'backoff==1.8.0',
           'pandas==1.2.4'
       ],
+      extras_require={
+          'bulk': [
+              'pyarrow>=7.0.0',
+          ],
+      },
       entry_points='''
           [console_scripts]
           tap-timebutler=tap_timebutler:main
+          tap-timebutler-synthetic=tap_timebutler.synthetic:main
       ''',
       packages=['tap_timebutler'],
       package_data = {
@@ -30,6 +36,8 @@ setup(name='tap-timebutler',
               "worktime.json",
               "projects.json",
               "services.json",
+              "daily_worktime.json",
+              "absence_ranges.json",
           ],
       },
       include_package_data=True,
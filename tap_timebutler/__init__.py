@@ -1,21 +1,41 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import bisect
+import hashlib
+import json
+import multiprocessing
+import queue
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache, partial
 
 import backoff
 import requests
 import csv
 import numpy as np
-import pandas as pd
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from datetime import timedelta, date, datetime
 
 import singer
 from singer import Transformer, utils
 
+from tap_timebutler.bulk import BulkExporter
+from tap_timebutler.cassette import Cassette
+from tap_timebutler.dates import parse_date, parse_day, to_iso, to_iso_column
+from tap_timebutler.decimals import (set_decimal_separator, to_integer, to_integer_column, to_number,
+                                     to_number_column)
+from tap_timebutler.dry_run import DryRunReport
+from tap_timebutler.hedging import Hedger
+from tap_timebutler.prefetch import Prefetcher
+from tap_timebutler.profiling import UnitMemoryProfiler, UnitProfiler
+from tap_timebutler.writer import QueueWriter, ThreadedWriter
+
 LOGGER = singer.get_logger()
 SESSION = requests.Session()
 REQUIRED_CONFIG_KEYS = [
-    "auth_token",
     "x_dfa_token"
 ]
 
@@ -25,6 +45,66 @@ CONFIG = {}
 STATE = {}
 AUTH = {}
 HOLIDAYS = {}
+HOLIDAY_RESPONSES = {}
+ACCOUNT_ID = None
+ROOT_STATE = None
+CASSETTE = None
+BULK_EXPORT = None
+DAILY_WORKTIME = None
+PROFILER = None
+MEMORY_PROFILER = None
+PARSE_POOL = None
+PARSE_WORKERS = 0
+DRY_RUN = None
+WRITER = None
+PREFETCHER = None
+HEDGER = None
+ACCOUNT_MESSAGES = None
+PENDING_DIGESTS = {}
+
+DEFAULT_MAX_IN_FLIGHT_RECORDS = 1000
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 300
+EXPORT_CHUNK_SIZE = 64 * 1024
+DEFAULT_FIRST_YEAR = 2010
+PARSE_CHUNK_LINES = 5000
+ROW_BATCH_LINES = 500
+
+DAY_KEY_SPAN = 100000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+DEFAULT_ABSENCE_TYPES = {
+    "Vacation": {"absence_shorthandle": "URL", "absence_id": 101},
+    "Sickness": {"absence_shorthandle": "KRA", "absence_id": 102},
+    "Feiertag": {"absence_shorthandle": "FEI", "absence_id": 103},
+    "miscellaneous": {"absence_shorthandle": "SON", "absence_id": 104},
+    "Ze": {"absence_shorthandle": "ZAG", "absence_id": 105},
+    "Berufsschule/Uni": {"absence_shorthandle": "BER", "absence_id": 106},
+    "Pflicht/AS": {"absence_shorthandle": "PFL", "absence_id": 107},
+    "TaikoWeekend": {"absence_shorthandle": "TAW", "absence_id": 108},
+    "Overtime": {"absence_shorthandle": "OVT", "absence_id": 109},
+    "Overtime reduction request": {"absence_shorthandle": "OVT-R", "absence_id": 110},
+    "Un": {"absence_shorthandle": "BER", "absence_id": 111},
+}
+DEFAULT_ABSENCE_TYPE = {"absence_shorthandle": "UNK", "absence_id": 100}
+ABSENCE_TYPES = dict(DEFAULT_ABSENCE_TYPES)
+UNKNOWN_ABSENCE_TYPES = set()
+
+HOLIDAY_REGION = "be"
+HOLIDAY_REGIONS = [
+    "bw", "by", "be", "bb", "hb", "hh", "he", "mv",
+    "ni", "nw", "rp", "sl", "sn", "st", "sh", "th",
+]
+
+WEEKDAY_FIELDS = [
+    "monday_working_time",
+    "tuesday_working_time",
+    "wednesday_working_time",
+    "thursday_working_time",
+    "friday_working_time",
+    "saturday_working_time",
+    "sunday_working_time",
+]
 
 
 class Auth:
@@ -44,12 +124,184 @@ class XDFA:
     def get_xdfa_token(self):
         return self._xdfa_token
 
+# Columns with the date format are emitted as ISO 8601 days, numeric
+# columns are typed while decoding, decimals use a comma.
+def get_converter(subschema):
+    if subschema.get("format") == "date":
+        return to_iso
+    if "integer" in subschema["type"]:
+        return to_integer
+    if "number" in subschema["type"]:
+        return to_number
+
+    return None
+
+COLUMN_CONVERTERS = {
+    to_iso: to_iso_column,
+    to_integer: to_integer_column,
+    to_number: to_number_column,
+}
+
+class RowLayout:
+    """Column positions of a stream schema, shared by all of its rows."""
+
+    __slots__ = ("properties", "index", "date_time_columns", "converters")
+
+    def __init__(self, schema):
+        self.properties = tuple(schema["properties"])
+        self.index = {key: i for i, key in enumerate(self.properties)}
+        self.date_time_columns = frozenset(
+            i for i, key in enumerate(self.properties)
+            if schema["properties"][key].get("format") == "date-time")
+        self.converters = tuple(
+            (i, converter) for i, converter in enumerate(map(get_converter, schema["properties"].values()))
+            if converter is not None)
+
+class Row:
+    """
+    Compact export row used between parsing and serialization.
+
+    Values are kept in a list ordered like the schema properties, a dict
+    is only materialized by as_dict right before the Transformer.
+    """
+
+    __slots__ = ("layout", "values")
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.layout.index[key]]
+
+    def __setitem__(self, key, value):
+        self.values[self.layout.index[key]] = value
+
+    def get(self, key, default=None):
+        i = self.layout.index.get(key)
+        if i is None or i >= len(self.values):
+            return default
+
+        return self.values[i]
+
+    def as_dict(self):
+        # Any date-times values can either be a string or a null. Parsing a
+        # null date-time is an error in the Transformer, so those are left
+        # out.
+        date_time_columns = self.layout.date_time_columns
+
+        return {
+            key: value
+            for i, (key, value) in enumerate(zip(self.layout.properties, self.values))
+            if value is not None or i not in date_time_columns
+        }
+
+class DailyWorktimeIndex:
+    """
+    In-memory index behind the derived daily_worktime stream.
+
+    Workday validity intervals are kept sorted per user so the planned
+    working time of any day is a single bisect lookup. Absence days and
+    booked worktime are summed per (user, day) while the regular streams
+    are emitted, so the derived rows come out of the same run.
+    """
+
+    def __init__(self, first_day, last_day):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.valid_from = defaultdict(list)
+        self.weekly_seconds = defaultdict(list)
+        self.employment = {}
+        self.absent = defaultdict(float)
+        self.booked = defaultdict(float)
+        self.holidays = set()
+
+    def add_workdays(self, user_id, valid_from, weekly_seconds):
+        starts = self.valid_from[user_id]
+        i = bisect.bisect_right(starts, valid_from)
+        starts.insert(i, valid_from)
+        self.weekly_seconds[user_id].insert(i, weekly_seconds)
+
+    def add_user(self, user_id, date_of_entry, date_of_separation):
+        self.employment[user_id] = (date_of_entry, date_of_separation)
+
+    def add_holiday(self, day):
+        self.holidays.add(day)
+
+    def add_absence(self, user_id, day, half_a_day):
+        # Overlapping absences must not count a day twice.
+        fraction = 0.5 if half_a_day else 1.0
+        key = (user_id, day)
+        self.absent[key] = min(1.0, max(self.absent[key], fraction))
+
+    def add_worktime(self, user_id, day, seconds):
+        self.booked[(user_id, day)] += seconds or 0
+
+    def expected_seconds(self, user_id, day):
+        starts = self.valid_from.get(user_id)
+        if not starts:
+            return 0
+
+        i = bisect.bisect_right(starts, day) - 1
+        if i < 0:
+            return 0
+
+        return self.weekly_seconds[user_id][i][day.weekday()]
+
+    def user_days(self, user_id):
+        first_day = self.first_day
+        last_day = self.last_day
+        entry, separation = self.employment.get(user_id, (None, None))
+
+        if entry is None and self.valid_from.get(user_id):
+            entry = self.valid_from[user_id][0]
+
+        if entry is not None and entry > first_day:
+            first_day = entry
+
+        if separation is not None and separation < last_day:
+            last_day = separation
+
+        return iter_days(first_day, last_day)
+
+    def rows(self):
+        users = set(self.valid_from) | set(self.employment)
+        users |= {user_id for user_id, _ in self.absent}
+        users |= {user_id for user_id, _ in self.booked}
+
+        for user_id in sorted(users):
+            for day in self.user_days(user_id):
+                expected = self.expected_seconds(user_id, day)
+
+                if day in self.holidays:
+                    absent = expected
+                else:
+                    absent = int(expected * self.absent.get((user_id, day), 0.0))
+
+                yield {
+                    "user_id": user_id,
+                    "the_day": day.isoformat(),
+                    "expected_seconds": expected,
+                    "absent_seconds": absent,
+                    "booked_seconds": self.booked.get((user_id, day), 0.0),
+                }
+
 def get_abs_path(path):
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
 
 
+# Emitted columns that are only converted to ISO days with iso_dates set,
+# targets of earlier versions expect the exported dd/mm/yyyy.
+ISO_DATE_COLUMNS = {"worktime": ["date_date"]}
+
 def load_schema(entity):
-    return utils.load_json(get_abs_path("schemas/{}.json".format(entity)))
+    schema = utils.load_json(get_abs_path("schemas/{}.json".format(entity)))
+
+    if CONFIG.get("iso_dates"):
+        for key in ISO_DATE_COLUMNS.get(entity, []):
+            schema["properties"][key]["format"] = "date"
+
+    return schema
 
 
 def load_and_write_schema(name, key_properties="id", bookmark_property="updated_at"):
@@ -69,56 +321,100 @@ def get_url(endpoint):
 def get_holiday_url(year):
     return HOLIDAY_API_URL + year
 
+def to_int(value):
+    return None if value is None else int(value)
+
+def index_record(schema_name, item):
+    if schema_name == "users":
+        DAILY_WORKTIME.add_user(item["id"],
+                                parse_date(item.get("date_of_entry")),
+                                parse_date(item.get("date_of_separation")))
+
+    elif schema_name == "worktime":
+        if CONFIG.get("iso_dates"):
+            day = date.fromisoformat(item["date_date"]) if item.get("date_date") else None
+        else:
+            day = parse_date(item.get("date_date"))
+
+        DAILY_WORKTIME.add_worktime(item["user_id"], day, item.get("working_time_in_seconds"))
+
+class UnknownAbsenceTypeError(Exception):
+    pass
+
+class ConfigError(Exception):
+    pass
+
+UNKNOWN_ABSENCE_TYPE_POLICIES = ("default", "skip", "fail")
+ABSENCE_TYPE_FIELDS = ("absence_shorthandle", "absence_id")
+
+# Resolves to the catalogue entry of an absence type, or None when rows of
+# an unknown type are skipped.
+def resolve_absence_type(absence_type):
+    entry = ABSENCE_TYPES.get(absence_type)
+    if entry is not None:
+        return entry
+
+    policy = CONFIG.get("unknown_absence_types", "default")
+
+    if policy == "fail":
+        raise UnknownAbsenceTypeError("Unknown absence type {!r}".format(absence_type))
+
+    if absence_type not in UNKNOWN_ABSENCE_TYPES:
+        UNKNOWN_ABSENCE_TYPES.add(absence_type)
+        LOGGER.warning("Unknown absence type {!r}, {} its absences".format(
+            absence_type, "skipping" if policy == "skip" else "using the default type for"))
+
+    if policy == "skip":
+        return None
+
+    return CONFIG.get("default_absence_type", DEFAULT_ABSENCE_TYPE)
+
 def handle_absence_types(absence_type, field):
+    entry = resolve_absence_type(absence_type)
+
+    return None if entry is None else entry[field]
+
+# A typo would silently change how absences are classified, the sync does
+# not start with one.
+def check_absence_types_config():
+    policy = CONFIG.get("unknown_absence_types", "default")
+    if policy not in UNKNOWN_ABSENCE_TYPE_POLICIES:
+        raise ConfigError("Invalid unknown_absence_types {!r}, expected one of {}".format(
+            policy, ", ".join(UNKNOWN_ABSENCE_TYPE_POLICIES)))
+
+    entries = dict(CONFIG.get("absence_types", {}))
+    if "default_absence_type" in CONFIG:
+        entries["default_absence_type"] = CONFIG["default_absence_type"]
+
+    for name, entry in entries.items():
+        if not isinstance(entry, dict) or any(field not in entry for field in ABSENCE_TYPE_FIELDS):
+            raise ConfigError("Absence type {!r} needs {}".format(name, " and ".join(ABSENCE_TYPE_FIELDS)))
+
+# The catalogue is built once per run, types from the config extend or
+# override the built-in ones.
+# Runs in every process that decodes exports, the parse workers included.
+def load_decimal_separator():
+    try:
+        set_decimal_separator(CONFIG.get("decimal_separator", ","))
+    except ValueError as exc:
+        raise ConfigError("Invalid decimal_separator: {}".format(exc)) from exc
 
-    absences_map = {
-      "Vacation": {
-        "absence_shorthandle": "URL",
-        "absence_id": 101,
-      },
-      "Sickness": {
-        "absence_shorthandle": "KRA",
-        "absence_id": 102,
-      },
-      "Feiertag": {
-        "absence_shorthandle": "FEI",
-        "absence_id": 103,
-      },
-      "miscellaneous": {
-        "absence_shorthandle": "SON",
-        "absence_id": 104,
-      },
-      "Ze": {
-        "absence_shorthandle": "ZAG",
-        "absence_id": 105,
-      },
-      "Berufsschule/Uni": {
-        "absence_shorthandle": "BER",
-        "absence_id": 106,
-      },
-      "Pflicht/AS": {
-        "absence_shorthandle": "PFL",
-        "absence_id": 107,
-      },
-      "TaikoWeekend": {
-        "absence_shorthandle": "TAW",
-        "absence_id": 108,
-      },
-      "Overtime": {
-        "absence_shorthandle": "OVT",
-        "absence_id": 109,
-      },
-      "Overtime reduction request": {
-        "absence_shorthandle": "OVT-R",
-        "absence_id": 110,
-      },
-      "Un": {
-        "absence_shorthandle": "BER",
-        "absence_id": 111,
-      },
-    }
+def load_absence_types():
+    check_absence_types_config()
+
+    ABSENCE_TYPES.clear()
+    ABSENCE_TYPES.update(DEFAULT_ABSENCE_TYPES)
+    ABSENCE_TYPES.update(CONFIG.get("absence_types", {}))
+
+# The read timeout applies to every read from the socket, not to the
+# download of the whole export.
+def get_timeout():
+    return (float(CONFIG.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)),
+            float(CONFIG.get("read_timeout", DEFAULT_READ_TIMEOUT)))
 
-    return absences_map[absence_type][field]
+# Holidays are requested per year, their latencies are tracked together.
+def get_hedge_endpoint(url):
+    return HOLIDAY_API_URL if url.startswith(HOLIDAY_API_URL) else url
 
 @backoff.on_exception(
     backoff.expo,
@@ -129,86 +425,472 @@ def handle_absence_types(absence_type, field):
 
 @utils.ratelimit(100, 15)
 
-def request(url, params={}, headers={}):
+def send_request(url, params=None, headers=None, stream=False):
     req = requests.Request("POST", url=url, params=params, headers=headers).prepare()
     LOGGER.info("POST {}".format(req.url))
-    resp = SESSION.send(req)
+    timeout = get_timeout()
+
+    # Only the wait for the headers is hedged, the body is read from the
+    # response that arrived first.
+    if HEDGER is not None:
+        resp = HEDGER.send(get_hedge_endpoint(url), partial(SESSION.send, req, stream=True, timeout=timeout))
+        if not stream:
+            resp.content  # pylint: disable=pointless-statement
+    else:
+        resp = SESSION.send(req, stream=stream, timeout=timeout)
+
     resp.raise_for_status()
 
     return resp
 
-# Any date-times values can either be a string or a null.
-# If null, parsing the date results in an error.
-# Instead, removing the attribute before parsing ignores this error.
-def remove_empty_date_times(item, schema):
-    fields = []
+def request(url, params=None, headers=None, stream=False):
+    params = params or {}
+    headers = headers or {}
+
+    if CASSETTE is not None and CASSETTE.replaying:
+        resp = CASSETTE.replay(url, params)
+        resp.raise_for_status()
+        return resp
+
+    resp = send_request(url, params, headers, stream)
+
+    if CASSETTE is not None:
+        CASSETTE.record(url, params, headers, resp)
+
+    return resp
+
+def get_max_in_flight_records():
+    return int(CONFIG.get("max_in_flight_records", DEFAULT_MAX_IN_FLIGHT_RECORDS))
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+def iter_days(day_from, day_to):
+    day = day_from
+    while day <= day_to:
+        yield day
+        day += timedelta(days=1)
+
+# Settings that change the records emitted for the same export, together
+# with OUTPUT_VERSION and the schemas they make up the fingerprint stored
+# next to each digest. Bump OUTPUT_VERSION when the tap changes records.
+OUTPUT_SETTINGS = ["absence_types", "default_absence_type", "unknown_absence_types", "iso_dates",
+                   "decimal_separator"]
+OUTPUT_VERSION = 1
+
+def get_output_fingerprint():
+    fingerprint = hashlib.sha256()
+    fingerprint.update(repr([(key, CONFIG.get(key)) for key in OUTPUT_SETTINGS]).encode("utf-8"))
+    fingerprint.update(str(OUTPUT_VERSION).encode("utf-8"))
+
+    schemas_dir = get_abs_path("schemas")
+    for name in sorted(os.listdir(schemas_dir)):
+        with open(os.path.join(schemas_dir, name), "rb") as schema_file:
+            fingerprint.update(schema_file.read())
+
+    return fingerprint.hexdigest()
+
+# A digest stored under other settings or by another version of the tap
+# does not allow skipping the export.
+def get_previous_digest(digest_key):
+    previous = STATE.get("digests", {}).get(digest_key, {})
+    if previous.get("fingerprint") != get_output_fingerprint():
+        return {}
+
+    return previous
+
+def get_digest_key(stream, params):
+    public_params = sorted((key, value) for key, value in params.items() if key != "auth")
+    if not public_params:
+        return stream
+
+    return stream + "?" + "&".join("{}={}".format(key, value) for key, value in public_params)
+
+def get_conditional_headers(previous):
+    headers = {}
+
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+
+    return headers
+
+def get_request_key(url, params):
+    return (url,) + tuple(sorted((key, str(value)) for key, value in params.items() if key != "auth"))
+
+def skips_unchanged():
+    # The daily_worktime index needs every row of the run.
+    return CONFIG.get("skip_unchanged") and DAILY_WORKTIME is None
+
+def send_export_request(schema_name, params, stream=None):
+    headers = {}
+
+    if skips_unchanged():
+        previous = get_previous_digest(get_digest_key(stream or schema_name, params))
+        headers = get_conditional_headers(previous)
+
+    # Unchanged exports can only be detected on the whole body.
+    stream_body = CONFIG.get("memory_bounded") and not skips_unchanged()
+
+    return request(get_url(schema_name), params, headers=headers, stream=stream_body)
+
+# Runs on the prefetch threads, the body is downloaded there as well.
+def prefetch_export(schema_name, params, stream=None):
+    response = send_export_request(schema_name, params, stream)
+    response.content  # pylint: disable=pointless-statement
+
+    return response
+
+def prefetch_holidays(url, headers):
+    response = request(url, {}, headers)
+    response.content  # pylint: disable=pointless-statement
+
+    return response
+
+def take_prefetched(url, params):
+    if PREFETCHER is None:
+        return None
+
+    return PREFETCHER.take(get_request_key(url, params))
 
-    for key in schema["properties"]:
-        subschema = schema["properties"][key]
-        if subschema.get("format") == "date-time":
-            fields.append(key)
+@contextmanager
+def prefetching(jobs):
+    global PREFETCHER  # pylint: disable=global-statement
+
+    depth = int(CONFIG.get("prefetch_depth", 0))
+    if depth <= 0:
+        yield
+        return
+
+    with ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch") as executor:
+        PREFETCHER = Prefetcher(executor, jobs, depth)
+        try:
+            yield
+        finally:
+            PREFETCHER.close()
+            PREFETCHER = None
 
-    for field in fields:
-        if item.get(field) is None:
-            del item[field]
+# Returns no lines when the export is byte-identical to the one synced by
+# the previous run. The new digest is only stored in the STATE once the
+# unit completed, see sync_unit.
+def get_changed_lines(response, digest_key):
+    previous = get_previous_digest(digest_key)
 
+    if response.status_code == 304:
+        LOGGER.info("Skipping {}, not modified since the previous run".format(digest_key))
+        return None
+
+    digest = hashlib.sha256(response.content).hexdigest()
+
+    if digest == previous.get("sha256"):
+        LOGGER.info("Skipping {}, unchanged since the previous run".format(digest_key))
+        return None
+
+    PENDING_DIGESTS[digest_key] = {
+        key: value for key, value in (
+            ("sha256", digest),
+            ("fingerprint", get_output_fingerprint()),
+            ("etag", response.headers.get("ETag")),
+            ("last_modified", response.headers.get("Last-Modified")),
+        ) if value
+    }
+
+    return response.content.decode("utf-8").splitlines()
+
+# In memory bounded mode the export is streamed and decoded chunk by
+# chunk, otherwise the whole body is decoded at once.
+def open_export(schema_name, params, stream=None):
+    response = take_prefetched(get_url(schema_name), params)
+    if response is None:
+        response = send_export_request(schema_name, params, stream)
+
+    time_extracted = utils.now()
+
+    if skips_unchanged():
+        lines = get_changed_lines(response, get_digest_key(stream or schema_name, params))
+    elif CONFIG.get("memory_bounded"):
+        response.encoding = "utf-8"
+        lines = response.iter_lines(chunk_size=EXPORT_CHUNK_SIZE, decode_unicode=True)
+    else:
+        lines = response.content.decode("utf-8").splitlines()
+
+    if DRY_RUN is not None and lines is not None:
+        lines = DRY_RUN.count_lines(lines)
+
+    return lines, time_extracted
+
+# Rows are padded to the schema width so that derived columns, like the
+# absence day, can be set by position. Lines are split in batches whose
+# columns are converted at once.
+def iter_rows(lines, layout, batch_lines=ROW_BATCH_LINES):
+    width = len(layout.properties)
+    padding = [None] * width
+    converters = [(i, COLUMN_CONVERTERS[converter]) for i, converter in layout.converters]
+
+    for batch in iter_batches(lines, batch_lines):
+        rows = [[value.strip() or None for value in line.split(";", width - 1)] for line in batch if line]
+
+        for values in rows:
+            if len(values) < width:
+                values.extend(padding[len(values):])
+
+        for i, convert in converters:
+            for values, value in zip(rows, convert([values[i] for values in rows])):
+                values[i] = value
+
+        for values in rows:
+            yield Row(layout, values)
+
+# Exports decoded by the pandas csv_engine. The text columns of the others
+# take read_csv longer to create than the row decoder.
+FRAME_EXPORTS = ("worktime",)
+
+def iter_export_rows(lines, layout, export=None):
+    lines = iter(lines)
+
+    # Skip the header line.
+    next(lines, None)
+
+    if CONFIG.get("csv_engine") == "pandas" and export in FRAME_EXPORTS:
+        from tap_timebutler.frames import iter_frame_values  # pylint: disable=import-outside-toplevel
+        return (Row(layout, values) for values in iter_frame_values(lines, layout, iter_rows))
+
+    return iter_rows(lines, layout)
+
+# All messages go through the writer thread when there is one, so SCHEMA
+# and STATE messages keep their order relative to the records.
+def write_message(message):
+    if WRITER is not None:
+        WRITER.write(singer.format_message(message) + "\n")
+    else:
+        singer.write_message(message)
+
+# With several accounts every record carries the id of its account, which
+# becomes part of the key.
+def get_account_schema(schema, key_properties):
+    if ACCOUNT_ID is None:
+        return schema, key_properties
+
+    properties = {**schema["properties"], "account_id": {"type": ["null", "string"]}}
+
+    return {**schema, "properties": properties}, ["account_id"] + list(key_properties)
+
+def iter_account_records(records):
+    for record in records:
+        record["account_id"] = ACCOUNT_ID
+        yield record
+
+def write_schema(schema_name, schema, key_properties):
+    if DRY_RUN is not None:
+        return
+
+    schema, key_properties = get_account_schema(schema, key_properties)
+
+    if BULK_EXPORT is not None:
+        BULK_EXPORT.add_schema(schema_name, schema)
+        return
+
+    write_message(singer.SchemaMessage(stream=schema_name,
+                                       schema=schema,
+                                       key_properties=key_properties))
+
+# Account workers hand their STATE to the main process, which writes the
+# STATE of all accounts.
+def write_state():
+    if DRY_RUN is not None:
+        return
+
+    if ACCOUNT_MESSAGES is not None:
+        ACCOUNT_MESSAGES.put(("state", ACCOUNT_ID, STATE))
+        return
+
+    write_message(singer.StateMessage(value=STATE if ROOT_STATE is None else ROOT_STATE))
+
+def write_text(text):
+    if WRITER is not None:
+        WRITER.write(text)
+    else:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+def write_records(schema_name, records, time_extracted, partition=None):
+    if ACCOUNT_ID is not None:
+        records = iter_account_records(records)
+
+    if DRY_RUN is not None:
+        DRY_RUN.consume(schema_name, records, time_extracted)
+        return
+
+    batches = iter_batches(records, get_max_in_flight_records())
+
+    if BULK_EXPORT is not None:
+        BULK_EXPORT.write(schema_name, partition, batches)
+        return
+
+    for batch in batches:
+        text = "".join(
+            singer.format_message(singer.RecordMessage(stream=schema_name,
+                                                       record=record,
+                                                       time_extracted=time_extracted)) + "\n"
+            for record in batch)
+
+        write_text(text)
+
+# Expanded absence days and holidays get composite ids, stable across
+# runs and unique within the absences stream:
+#   absence day:  source id * DAY_KEY_SPAN + day
+#   holiday:      -(region index * DAY_KEY_SPAN + day)
+# where day counts the days since 1970-01-01.
+def get_day_key(day):
+    return day.toordinal() - EPOCH_ORDINAL
+
+def get_holiday_id(region, day):
+    return -(HOLIDAY_REGIONS.index(region) * DAY_KEY_SPAN + get_day_key(day))
+
+def iter_holiday_records(response, schema, transformer):
+    for row in response["holidays"]:
+
+        holidays = {}
+
+        if row["holiday"]["regions"][HOLIDAY_REGION] == True:
+
+            date_split = row["holiday"]["date"].split("-")
+
+            date_object = date(year=int(date_split[0]), month=int(date_split[1]), day=int(date_split[2]))
+
+            formatted_date = date_object.strftime("%Y-%m-%d")
+
+            LOGGER.info(formatted_date)
+
+            holidays["id"] = get_holiday_id(HOLIDAY_REGION, date_object)
+            holidays["day_from"] = formatted_date
+            holidays["day_to"] = formatted_date
+            holidays["user_id"] = 370701
+            holidays["the_day"] = formatted_date
+            holidays["absence_type"] = "Feiertag"
+            holidays["absence_state"] = "Approved"
+            holidays["comments"] = row["holiday"]["name"]
+            holidays["absence_shorthandle"] = handle_absence_types(holidays["absence_type"], "absence_shorthandle")
+            holidays["absence_id"] = handle_absence_types(holidays["absence_type"], "absence_id")
+
+            HOLIDAYS[date_object] = row["holiday"]["name"]
+
+            if DAILY_WORKTIME is not None:
+                DAILY_WORKTIME.add_holiday(date_object)
+
+            yield transformer.transform(holidays, schema)
+
+# The holidays are the same for every account of the run.
+# The body is kept rather than the parsed holidays so dry runs can count
+# the bytes read for every account using it.
+def load_holiday_body(year):
+    if year not in HOLIDAY_RESPONSES:
+        url = get_holiday_url(year)
+        headers = {"X-DFA-Token": XDFA.get_xdfa_token()}
+        response = take_prefetched(url, {}) or request(url, {}, headers)
+        HOLIDAY_RESPONSES[year] = response.content
+
+    return HOLIDAY_RESPONSES[year]
+
+def load_holiday_response(year):
+    return json.loads(load_holiday_body(year))
 
 def get_holidays(year):
 
     schema_name = "absences"
     schema = load_schema(schema_name)
 
-    singer.write_schema(schema_name,
-                        schema,
-                        ["id"])
-
-    xdfa_token = XDFA.get_xdfa_token()
-    headers = {"X-DFA-Token": xdfa_token}
-    params = {}
+    write_schema(schema_name,
+                 schema,
+                 ["id"])
 
     with Transformer() as transformer:
-        url = get_holiday_url(year)
-
-        response = request(url, params, headers)
+        body = load_holiday_body(year)
+        response = json.loads(body)
         time_extracted = utils.now()
-        response = response.json()
 
-        id = 1
-        
-        for row in response["holidays"]:
+        if DRY_RUN is not None:
+            DRY_RUN.count_body(len(body), len(response["holidays"]))
+
+        write_records(schema_name,
+                      iter_holiday_records(response, schema, transformer),
+                      time_extracted,
+                      partition=year)
+
+def iter_absence_records(rows, schema, transformer):
+    for aligned_schema_row in rows:
+
+        absence_type = resolve_absence_type(aligned_schema_row["absence_type"])
+        if absence_type is None:
+            continue
+
+        aligned_schema_row["absence_shorthandle"] = absence_type["absence_shorthandle"]
+        aligned_schema_row["absence_id"] = absence_type["absence_id"]
+
+        date_from = parse_date(aligned_schema_row["day_from"])
+        date_to = parse_date(aligned_schema_row["day_to"])
+
+        source_id = int(aligned_schema_row["id"])
+        id_base = source_id * DAY_KEY_SPAN - EPOCH_ORDINAL
+
+        aligned_schema_row["source_id"] = source_id
 
-            holidays = {}
+        for day in iter_days(date_from, date_to):
 
-            if row["holiday"]["regions"]["be"] == True:
+            date_aligned_shema_row = aligned_schema_row
 
-                date_split = row["holiday"]["date"].split("-")
+            date_aligned_shema_row["id"] = id_base + day.toordinal()
+            date_aligned_shema_row["the_day"] = day.isoformat()
 
-                date_object = date(year=int(date_split[0]), month=int(date_split[1]), day=int(date_split[2]))
+            item = transformer.transform(date_aligned_shema_row.as_dict(), schema)
 
-                formatted_date = date_object.strftime("%Y-%m-%d")
+            if DAILY_WORKTIME is not None and item.get("absence_state") == "Approved":
+                DAILY_WORKTIME.add_absence(to_int(item["user_id"]), day, item.get("half_a_day"))
 
-                LOGGER.info(formatted_date)
+            yield item
 
-                holidays["id"] = id
-                holidays["day_from"] = formatted_date
-                holidays["day_to"] = formatted_date
-                holidays["user_id"] = 370701
-                holidays["the_day"] = formatted_date
-                holidays["absence_type"] = "Feiertag"
-                holidays["absence_state"] = "Approved"
-                holidays["comments"] = row["holiday"]["name"]
-                holidays["absence_shorthandle"] = handle_absence_types(holidays["absence_type"], "absence_shorthandle")
-                holidays["absence_id"] = handle_absence_types(holidays["absence_type"], "absence_id")
+# One record per source absence instead of one per calendar day. Days
+# are only expanded when the daily_worktime index needs them.
+def iter_absence_range_records(rows, schema, transformer):
+    holidays = np.array(sorted(HOLIDAYS), dtype="datetime64[D]")
 
-                id += 1
+    for row in rows:
 
-                item = transformer.transform(holidays, schema)
+        absence_type = resolve_absence_type(row["absence_type"])
+        if absence_type is None:
+            continue
 
-                singer.write_record(schema_name,
-                                    item,
-                                    time_extracted=time_extracted)
+        date_from, day_from = parse_day(row["day_from"])
+        date_to, day_to = parse_day(row["day_to"])
+        day_after = date_to + timedelta(days=1)
 
-    singer.write_state(STATE)
+        absence_range = row.as_dict()
+        absence_range.pop("the_day", None)
+        absence_range.pop("source_id", None)
+
+        absence_range["day_from"] = day_from
+        absence_range["day_to"] = day_to
+        absence_range["day_count"] = (day_after - date_from).days
+        absence_range["workday_count"] = int(np.busday_count(date_from, day_after, holidays=holidays))
+        absence_range["absence_shorthandle"] = absence_type["absence_shorthandle"]
+        absence_range["absence_id"] = absence_type["absence_id"]
+
+        item = transformer.transform(absence_range, schema)
+
+        if item.get("half_a_day") and item["workday_count"]:
+            item["workday_count"] = 0.5
+
+        if DAILY_WORKTIME is not None and item.get("absence_state") == "Approved":
+            for day in iter_days(date_from, date_to):
+                DAILY_WORKTIME.add_absence(to_int(item["user_id"]), day, item.get("half_a_day"))
+
+        yield item
 
 def sync_absences(schema_name, year):
     schema = load_schema(schema_name)
@@ -217,130 +899,190 @@ def sync_absences(schema_name, year):
     auth_params = {"auth": auth_token}
     params = {**auth_params, **year}
 
-    singer.write_schema(schema_name,
-                        schema,
-                        ["id"])
+    if CONFIG.get("absences_mode", "days") == "ranges":
+        sync_absence_ranges(schema, params)
+        return
+
+    write_schema(schema_name,
+                 schema,
+                 ["id"])
 
     with Transformer() as transformer:
-        url = get_url(schema_name)
-        response = request(url, params, headers={})
-        response = response.content.decode("utf-8")
-        cr = csv.reader(response.splitlines(), delimiter=",")
-        response = list(cr)
+        lines, time_extracted = open_export(schema_name, params)
+        if lines is None:
+            return
 
-        time_extracted = utils.now()
+        rows = iter_export_rows(lines, RowLayout(schema), schema_name)
 
-        properties = list(schema["properties"])
+        write_records(schema_name,
+                      iter_absence_records(rows, schema, transformer),
+                      time_extracted,
+                      partition=params["year"])
 
-        del response[0]
+def sync_absence_ranges(absences_schema, params):
+    schema_name = "absence_ranges"
+    schema = load_schema(schema_name)
 
-        for row in response:
+    write_schema(schema_name,
+                 schema,
+                 ["id"])
 
-            aligned_schema_row = {}
+    with Transformer() as transformer:
+        lines, time_extracted = open_export("absences", params, stream=schema_name)
+        if lines is None:
+            return
 
-            row = np.array(row[0].split(";"))
+        rows = iter_export_rows(lines, RowLayout(absences_schema), "absences")
 
-            i = 0
+        write_records(schema_name,
+                      iter_absence_range_records(rows, schema, transformer),
+                      time_extracted,
+                      partition=params["year"])
 
-            while i < len(row):
+# The earliest employment seen is kept in the STATE so it is still known
+# when the users unit is skipped by a later run.
+def observe_employment(user):
+    date_of_entry = parse_date(user.get("date_of_entry"))
+    if date_of_entry is None:
+        return
 
-                if properties[i] == "the_day":
+    earliest = STATE.get("earliest_employment")
+    if earliest is None or date_of_entry.isoformat() < earliest:
+        STATE["earliest_employment"] = date_of_entry.isoformat()
 
-                    continue
+def observe_record(schema_name, item):
+    if schema_name == "users":
+        observe_employment(item)
 
-                elif properties[i] == "absence_shorthandle":
+    if DAILY_WORKTIME is not None:
+        index_record(schema_name, item)
 
-                  continue
+def iter_endpoint_records(schema_name, rows, schema, transformer):
+    for row in rows:
 
-                elif properties[i] == "absence_id":
+        item = transformer.transform(row.as_dict(), schema)
 
-                  continue
+        observe_record(schema_name, item)
 
-                else:
+        yield item
 
-                    aligned_schema_row[properties[i]] = None if row[i].strip() == "" else row[i].strip()
-                
-                i += 1
+# Parse workers get the config of the run.
+def init_parse_worker(config):
+    CONFIG.update(config)
+    load_decimal_separator()
 
-            # d0/m1/Y2
-            date_from = aligned_schema_row["day_from"].split("/")
-            date_to = aligned_schema_row["day_to"].split("/")
+# Worker processes are started by a fork server, a fork of the tap itself
+# would copy the locks held by its threads.
+def get_worker_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
 
-            k = 0
+    return multiprocessing.get_context("spawn")
 
-            # m1/d0/Y2
-            daterange = pd.date_range(start=date_from[1] + "/" + date_from[0] + "/" + date_from[2], end=date_to[1] + "/" + date_to[0] + "/" + date_to[2], periods=None, freq="D", tz=None, normalize=True, closed=None)
+# Every worker process loads a schema and builds its layout once.
+@lru_cache(maxsize=None)
+def get_parse_layout(schema_name):
+    schema = load_schema(schema_name)
+    return schema, RowLayout(schema)
 
-            for dt in daterange:
+# Runs in the PARSE_POOL worker processes.
+def parse_export_chunk(schema_name, chunk):
+    schema, layout = get_parse_layout(schema_name)
+    rows = iter_rows(chunk.split("\n"), layout)
 
-                date_aligned_shema_row = aligned_schema_row
+    with Transformer() as transformer:
+        return [transformer.transform(row.as_dict(), schema) for row in rows]
 
-                date = dt.strftime("%Y/%m/%d")
-              
-                date_aligned_shema_row["id"] = int(date_aligned_shema_row["id"]) + k
-                date_aligned_shema_row["the_day"] = date
+# The export is cut into newline aligned chunks that are parsed and
+# transformed by the worker processes. Only a bounded window of chunks is
+# in flight and results are taken in submission order, so records come
+# out in the order of the export.
+def iter_pooled_endpoint_records(schema_name, lines):
+    lines = iter(lines)
 
-                date_aligned_shema_row["absence_shorthandle"] = handle_absence_types(date_aligned_shema_row["absence_type"], "absence_shorthandle")
-                date_aligned_shema_row["absence_id"] = handle_absence_types(date_aligned_shema_row["absence_type"], "absence_id")
+    # Skip the header line.
+    next(lines, None)
 
-                k += 1
+    window = PARSE_WORKERS * 2
+    pending = deque()
 
-                remove_empty_date_times(date_aligned_shema_row, schema)
+    for batch in iter_batches(lines, PARSE_CHUNK_LINES):
+        pending.append(PARSE_POOL.submit(parse_export_chunk, schema_name, "\n".join(batch)))
 
-                item = transformer.transform(date_aligned_shema_row, schema)
+        if len(pending) < window:
+            continue
 
-                singer.write_record(schema_name,
-                                    item,
-                                    time_extracted=time_extracted)
+        for item in pending.popleft().result():
+            observe_record(schema_name, item)
+            yield item
 
-    singer.write_state(STATE)
+    while pending:
+        for item in pending.popleft().result():
+            observe_record(schema_name, item)
+            yield item
 
-def sync_endpoint(schema_name, params={}):
+def sync_endpoint(schema_name, params=None):
     schema = load_schema(schema_name)
 
     auth_token = AUTH.get_auth_token()
     auth_params = {"auth": auth_token}
-    params = {**auth_params, **params}
+    params = {**auth_params, **(params or {})}
 
-    singer.write_schema(schema_name,
-                        schema,
-                        ["id"])
+    write_schema(schema_name,
+                 schema,
+                 ["id"])
 
     with Transformer() as transformer:
-        url = get_url(schema_name)
-        response = request(url, params, headers={})
-        response = response.content.decode("utf-8")
-        cr = csv.reader(response.splitlines(), delimiter=",")
-        time_extracted = utils.now()
-        response = list(cr)
+        lines, time_extracted = open_export(schema_name, params)
+        if lines is None:
+            return
 
-        properties = list(schema["properties"])
+        if PARSE_POOL is not None:
+            records = iter_pooled_endpoint_records(schema_name, lines)
+        else:
+            rows = iter_export_rows(lines, RowLayout(schema), schema_name)
+            records = iter_endpoint_records(schema_name, rows, schema, transformer)
 
-        del response[0]
+        write_records(schema_name,
+                      records,
+                      time_extracted,
+                      partition=params.get("year"))
 
-        for row in response:
+def index_workdays():
+    layout = RowLayout(load_schema("workdays"))
 
-            aligned_schema_row = {}
+    auth_token = AUTH.get_auth_token()
+    params = {"auth": auth_token}
 
-            row = np.array(row[0].split(";"))
+    lines, _ = open_export("workdays", params)
 
-            i = 0
+    for row in iter_export_rows(lines, layout):
 
-            while i < len(row):
+        if row["valid_from"] is None:
+            continue
 
-                aligned_schema_row[properties[i]] = None if row[i].strip() == "" else row[i].strip()
+        valid_from = date.fromisoformat(row["valid_from"])
 
-                i += 1
+        # Planned working time is exported in minutes per weekday, with a
+        # decimal comma.
+        weekly_seconds = tuple(round((to_number(row.get(field)) or 0) * 60) for field in WEEKDAY_FIELDS)
+
+        DAILY_WORKTIME.add_workdays(int(row["user_id"]), valid_from, weekly_seconds)
 
-            remove_empty_date_times(aligned_schema_row, schema)
+def sync_daily_worktime():
+    schema_name = "daily_worktime"
+    schema = load_schema(schema_name)
+
+    write_schema(schema_name,
+                 schema,
+                 ["user_id", "the_day"])
 
-            item = transformer.transform(aligned_schema_row, schema)
+    time_extracted = utils.now()
 
-            singer.write_record(schema_name,
-                                item,
-                                time_extracted=time_extracted)
+    with Transformer() as transformer:
+        records = (transformer.transform(row, schema) for row in DAILY_WORKTIME.rows())
 
-    singer.write_state(STATE)
+        write_records(schema_name, records, time_extracted)
 
 def sync_workdays(schema_name):
     schema = load_schema(schema_name)
@@ -349,9 +1091,9 @@ def sync_workdays(schema_name):
     auth_params = {"auth": auth_token}
     params = {**auth_params}
 
-    singer.write_schema(schema_name,
-                        schema,
-                        ["id"])
+    write_schema(schema_name,
+                 schema,
+                 ["id"])
 
     with Transformer() as transformer:
         url = get_url(schema_name)
@@ -425,48 +1167,495 @@ def sync_workdays(schema_name):
     # singer.write_state(STATE)
 
 
+class SyncFailedError(Exception):
+    pass
+
+def get_unit_key(year):
+    return "all" if year is None else str(year)
+
+def is_unit_completed(stream, year):
+    return get_unit_key(year) in STATE.get("checkpoints", {}).get(stream, [])
+
+def mark_unit_completed(stream, year):
+    completed = STATE.setdefault("checkpoints", {}).setdefault(stream, [])
+    if get_unit_key(year) not in completed:
+        completed.append(get_unit_key(year))
+
+def tolerates_failures():
+    return CONFIG.get("max_failed_units") is not None
+
+def get_failed_units(exclude=None):
+    return sum(len(units) for stream, units in STATE.get("failed_units", {}).items() if stream != exclude)
+
+def mark_unit_failed(stream, year):
+    failed = STATE.setdefault("failed_units", {}).setdefault(stream, [])
+    if get_unit_key(year) not in failed:
+        failed.append(get_unit_key(year))
+
+def clear_unit_failed(stream, year):
+    failed = STATE.get("failed_units", {})
+    if get_unit_key(year) in failed.get(stream, []):
+        failed[stream].remove(get_unit_key(year))
+        if not failed[stream]:
+            del failed[stream]
+    if "failed_units" in STATE and not failed:
+        del STATE["failed_units"]
+
+# Reports and profiles name the account of a unit, if there are several.
+def get_unit_stream(stream):
+    return stream if ACCOUNT_ID is None else "{}.{}".format(ACCOUNT_ID, stream)
+
+def run_unit(stream, year, sync_function, *args):
+    unit_stream = get_unit_stream(stream)
+
+    if DRY_RUN is not None:
+        DRY_RUN.start_unit(unit_stream, get_unit_key(year))
+
+    if BULK_EXPORT is not None:
+        BULK_EXPORT.start_unit("{}:{}".format(stream, get_unit_key(year)))
+
+    try:
+        with ExitStack() as profiling:
+            if MEMORY_PROFILER is not None:
+                profiling.enter_context(MEMORY_PROFILER.profile(unit_stream, get_unit_key(year)))
+            if PROFILER is not None:
+                profiling.enter_context(PROFILER.profile(unit_stream, get_unit_key(year)))
+
+            sync_function(*args)
+    except Exception:
+        PENDING_DIGESTS.clear()
+        raise
+
+    if DRY_RUN is not None:
+        DRY_RUN.finish_unit()
+
+# A unit is one stream for one year (or the whole stream when it is not
+# synced per year). A checkpoint is written after every completed unit so
+# a resumed run continues with the first unit that did not complete.
+# Units that later units depend on in memory, like the holidays, are
+# always synced again.
+#
+# With max_failed_units set, a unit that still fails after unit_retries
+# attempts is recorded in the STATE and the sync continues with the next
+# unit. Records of a failed attempt may already have been emitted, the
+# retry emits them again.
+def sync_unit(stream, year, sync_function, *args, resumable=True):
+    if resumable and is_unit_completed(stream, year):
+        LOGGER.info("Skipping {} {}, completed by the previous run".format(stream, get_unit_key(year)))
+        return
+
+    attempts = 1 + int(CONFIG.get("unit_retries", 0)) if tolerates_failures() else 1
+
+    for attempt in range(1, attempts + 1):
+        try:
+            run_unit(stream, year, sync_function, *args)
+            break
+        except Exception as exc:  # pylint: disable=broad-except
+            if not tolerates_failures():
+                raise
+
+            LOGGER.warning("Attempt {} of {} for {} {} failed: {}".format(
+                attempt, attempts, stream, get_unit_key(year), exc))
+    else:
+        LOGGER.error("Giving up on {} {}, it is retried by the next run".format(stream, get_unit_key(year)))
+        mark_unit_failed(stream, year)
+        write_state()
+        return
+
+    mark_unit_completed(stream, year)
+    clear_unit_failed(stream, year)
+
+    if PENDING_DIGESTS:
+        STATE.setdefault("digests", {}).update(PENDING_DIGESTS)
+        PENDING_DIGESTS.clear()
+
+    # The manifest lists the files of the completed units, so a resumed
+    # run can pick it up.
+    if BULK_EXPORT is not None:
+        STATE["bulk_export"] = BULK_EXPORT.write_manifest()
+
+    write_state()
+
+def get_first_year():
+    if CONFIG.get("start_date"):
+        return utils.strptime_to_utc(CONFIG["start_date"]).year
+
+    return DEFAULT_FIRST_YEAR
+
+# No data can exist before the start date, before the earliest employment
+# or before the bookmark of the stream, so those years are not requested.
+# Years that failed in a previous run are synced again, even when they
+# are outside of that range now.
+def get_sync_years(stream, today):
+    first_year = get_first_year()
+
+    if STATE.get("earliest_employment"):
+        first_year = max(first_year, int(STATE["earliest_employment"][:4]))
+
+    if isinstance(STATE.get(stream), str):
+        first_year = max(first_year, utils.strptime_to_utc(STATE[stream]).year)
+
+    years = set(range(min(first_year, today.year), today.year + 1))
+    years.update(int(unit) for unit in STATE.get("failed_units", {}).get(stream, []) if unit != "all")
+
+    return sorted(years)
+
+def get_holiday_jobs(years):
+    headers = {"X-DFA-Token": XDFA.get_xdfa_token()}
+
+    return [
+        (get_request_key(get_holiday_url(str(year)), {}),
+         partial(prefetch_holidays, get_holiday_url(str(year)), headers))
+        for year in years
+        if str(year) not in HOLIDAY_RESPONSES
+    ]
+
+# Units completed by an interrupted run are not fetched again.
+def get_export_jobs(schema_name, years, stream=None):
+    jobs = []
+
+    for year in years:
+        if is_unit_completed(schema_name, year):
+            continue
+
+        params = {"auth": AUTH.get_auth_token(), "year": year}
+        jobs.append((get_request_key(get_url(schema_name), params),
+                     partial(prefetch_export, schema_name, params, stream)))
+
+    return jobs
+
 def do_sync():
     LOGGER.info("Starting sync")
 
     today = datetime.now()
-    years = range(2010,today.year + 1)
 
-    for year in years:
-        get_holidays(str(year))
+    global DAILY_WORKTIME  # pylint: disable=global-statement
+    if CONFIG.get("daily_worktime"):
+        DAILY_WORKTIME = DailyWorktimeIndex(date(get_first_year(), 1, 1), today.date())
 
-    for year in years:
-        sync_absences("absences", {"year": year})
+    resume = CONFIG.get("resume") and "checkpoints" in STATE
+    if resume and DAILY_WORKTIME is not None:
+        LOGGER.warning("Not resuming, daily_worktime needs every stream of the run")
+        resume = False
 
-    sync_endpoint("users")
+    if resume:
+        LOGGER.info("Resuming the previous run")
+        if BULK_EXPORT is not None:
+            BULK_EXPORT.resume()
+    else:
+        STATE.pop("checkpoints", None)
 
-    for year in years:
-        sync_endpoint("holidayentitlement", {"year": year})
+    # The workdays are only indexed, a failure skips daily_worktime below.
+    if DAILY_WORKTIME is not None:
+        sync_unit("workdays", None, index_workdays, resumable=False)
+
+    # Users come first, the employment dates limit the years of the
+    # streams below.
+    sync_unit("users", None, sync_endpoint, "users")
+
+    years = get_sync_years("holidays", today)
+    with prefetching(get_holiday_jobs(years)):
+        for year in years:
+            sync_unit("holidays", year, get_holidays, str(year), resumable=False)
+
+    years = get_sync_years("absences", today)
+    absences_stream = "absence_ranges" if CONFIG.get("absences_mode") == "ranges" else "absences"
+    with prefetching(get_export_jobs("absences", years, absences_stream)):
+        for year in years:
+            sync_unit("absences", year, sync_absences, "absences", {"year": year})
+
+    years = get_sync_years("holidayentitlement", today)
+    with prefetching(get_export_jobs("holidayentitlement", years)):
+        for year in years:
+            sync_unit("holidayentitlement", year, sync_endpoint, "holidayentitlement", {"year": year})
 
     # sync_workdays("workdays")
 
-    sync_endpoint("worktime")
+    sync_unit("worktime", None, sync_endpoint, "worktime")
+
+    sync_unit("projects", None, sync_endpoint, "projects")
+
+    sync_unit("services", None, sync_endpoint, "services")
+
+    # The derived rows would be incomplete without every unit of the run.
+    if DAILY_WORKTIME is not None:
+        if get_failed_units(exclude="daily_worktime"):
+            LOGGER.error("Skipping daily_worktime, other units of the run failed")
+            mark_unit_failed("daily_worktime", None)
+        else:
+            sync_unit("daily_worktime", None, sync_daily_worktime)
+
+    if BULK_EXPORT is not None:
+        STATE["bulk_export"] = BULK_EXPORT.write_manifest()
+
+    if PROFILER is not None:
+        LOGGER.info("Profile summary written to {}".format(PROFILER.write_summary()))
+
+    if MEMORY_PROFILER is not None:
+        LOGGER.info("Memory profile written to {}".format(MEMORY_PROFILER.write_report()))
 
-    sync_endpoint("projects")
+    if DRY_RUN is not None:
+        DRY_RUN.write()
 
-    sync_endpoint("services")
+    # The latencies are shared by all accounts of the run.
+    if HEDGER is not None:
+        (STATE if ROOT_STATE is None else ROOT_STATE)["hedge_latencies"] = HEDGER.tracker.dump()
+
+    # The run completed, the next one starts from the first unit again.
+    STATE.pop("checkpoints", None)
+    write_state()
+
+    failed_units = get_failed_units()
+    if failed_units:
+        LOGGER.error("Failed units: {}".format(STATE["failed_units"]))
+    if failed_units > int(CONFIG.get("max_failed_units") or 0):
+        raise SyncFailedError("{} units failed, more than max_failed_units allows".format(failed_units))
     
     LOGGER.info("Sync complete")
 
+# With several accounts every account writes its own files, below its id.
+def get_account_path(path, is_file=False):
+    if ACCOUNT_ID is None:
+        return path
+
+    if is_file:
+        root, extension = os.path.splitext(path)
+        return "{}-{}{}".format(root, ACCOUNT_ID, extension)
+
+    return os.path.join(path, ACCOUNT_ID)
+
+# Resources shared by all accounts of the run.
+def open_run():
+    global XDFA, CASSETTE, HEDGER  # pylint: disable=global-statement
+    load_absence_types()
+    load_decimal_separator()
+    XDFA = XDFA(CONFIG["x_dfa_token"])
+    if CONFIG.get("cassette_mode"):
+        CASSETTE = Cassette(CONFIG.get("cassette_dir", "cassettes"), CONFIG["cassette_mode"],
+                            shared_urls=(HOLIDAY_API_URL,))
+    if CONFIG.get("hedge_percentile"):
+        HEDGER = Hedger(float(CONFIG["hedge_percentile"]),
+                        int(CONFIG.get("hedge_min_samples", 20)),
+                        float(CONFIG["hedge_after_seconds"]) if CONFIG.get("hedge_after_seconds") else None)
+
+# Outputs whose files, manifests and summaries belong to one account.
+def open_outputs():
+    global BULK_EXPORT, DRY_RUN, PROFILER, MEMORY_PROFILER  # pylint: disable=global-statement
+    if CONFIG.get("bulk_export_path"):
+        BULK_EXPORT = BulkExporter(get_account_path(CONFIG["bulk_export_path"]),
+                                   CONFIG.get("bulk_export_format", "parquet"))
+    if CONFIG.get("dry_run"):
+        report = CONFIG.get("dry_run_report")
+        DRY_RUN = DryRunReport(get_account_path(report, is_file=True) if report else None)
+    if CONFIG.get("profile_dir"):
+        PROFILER = UnitProfiler(get_account_path(CONFIG["profile_dir"]))
+    if CONFIG.get("memory_profile_path"):
+        MEMORY_PROFILER = UnitMemoryProfiler(get_account_path(CONFIG["memory_profile_path"], is_file=True))
+
+def use_account(account, state):
+    global STATE, AUTH, ACCOUNT_ID  # pylint: disable=global-statement
+    ACCOUNT_ID = str(account["account_id"])
+    AUTH = Auth(account["auth_token"])
+    STATE = state
+    if CASSETTE is not None:
+        CASSETTE.scope = ACCOUNT_ID
+    open_outputs()
+
+# The STATE of each account is kept below its id, a failing account does
+# not stop the others. By default the accounts are synced one after
+# another, sharing the HTTP session, the holiday responses and the
+# resources of the process.
+def sync_accounts(accounts):
+    global STATE, ROOT_STATE, ACCOUNT_ID  # pylint: disable=global-statement
+
+    ROOT_STATE = STATE
+    ROOT_STATE.setdefault("accounts", {})
+    workers = int(CONFIG.get("account_workers", 1))
+
+    try:
+        if workers > 1:
+            failed = sync_accounts_in_workers(accounts, workers)
+        else:
+            failed = []
+            for account in accounts:
+                use_account(account, ROOT_STATE["accounts"].setdefault(str(account["account_id"]), {}))
+
+                LOGGER.info("Syncing account {}".format(ACCOUNT_ID))
+
+                try:
+                    do_sync()
+                except Exception as exc:  # pylint: disable=broad-except
+                    LOGGER.error("Sync of account {} failed: {}".format(ACCOUNT_ID, exc))
+                    failed.append(ACCOUNT_ID)
+    finally:
+        STATE, ROOT_STATE, ACCOUNT_ID = ROOT_STATE, None, None
+
+    if failed:
+        raise SyncFailedError("Sync of accounts {} failed".format(", ".join(failed)))
+
+# Holidays of the years the accounts synced before are fetched once, up
+# front, and handed to the account workers. Only accounts with a stored
+# earliest employment bound their years, the years of the others are only
+# known once their users are synced. A year that cannot be fetched here is
+# left to the workers, where it fails or succeeds with its account.
+def load_shared_holidays(accounts):
+    global STATE  # pylint: disable=global-statement
+
+    today = datetime.now()
+    years = set()
+
+    try:
+        for account in accounts:
+            STATE = ROOT_STATE["accounts"].get(str(account["account_id"]), {})
+            if STATE.get("earliest_employment"):
+                years.update(get_sync_years("holidays", today))
+    finally:
+        STATE = ROOT_STATE
+
+    years = sorted(years)
+    with prefetching(get_holiday_jobs(years)):
+        for year in years:
+            try:
+                load_holiday_body(str(year))
+            except Exception as exc:  # pylint: disable=broad-except
+                LOGGER.warning("Could not fetch the holidays of {} up front, "
+                               "leaving them to the accounts: {}".format(year, exc))
+
+# At most account_workers accounts are synced at the same time, each in a
+# worker process of its own. The workers send their messages and STATE
+# here, where they are written to stdout and merged into the root STATE.
+def sync_accounts_in_workers(accounts, workers):
+    load_shared_holidays(accounts)
+
+    context = get_worker_context()
+    messages = context.Queue(maxsize=workers * 4)
+    pending = {str(account["account_id"]) for account in accounts}
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context,
+                             initializer=init_account_worker,
+                             initargs=(dict(CONFIG), dict(HOLIDAY_RESPONSES),
+                                       ROOT_STATE.get("hedge_latencies", {}), messages)) as executor:
+        futures = {
+            executor.submit(sync_account_in_worker, account,
+                            ROOT_STATE["accounts"].get(str(account["account_id"]), {})): str(account["account_id"])
+            for account in accounts
+        }
+
+        while pending:
+            try:
+                message = messages.get(timeout=1)
+            except queue.Empty:
+                # A worker that died never reports its account as done.
+                for future, account_id in futures.items():
+                    if account_id in pending and future.done() and future.exception() is not None:
+                        LOGGER.error("Sync of account {} failed: {}".format(account_id, future.exception()))
+                        pending.discard(account_id)
+                        failed.append(account_id)
+                continue
+
+            kind, payload = message[0], message[1:]
+
+            if kind == "text":
+                write_text(payload[0])
+            elif kind == "state":
+                account_id, state = payload
+                latencies = state.pop("hedge_latencies", None)
+                if latencies:
+                    ROOT_STATE.setdefault("hedge_latencies", {}).update(latencies)
+                ROOT_STATE["accounts"][account_id] = state
+                write_state()
+            else:
+                account_id, error = payload
+                pending.discard(account_id)
+                if error is not None:
+                    LOGGER.error("Sync of account {} failed: {}".format(account_id, error))
+                    failed.append(account_id)
+
+    return failed
+
+def init_account_worker(config, holiday_responses, hedge_latencies, messages):
+    global ACCOUNT_MESSAGES, WRITER  # pylint: disable=global-statement
+    CONFIG.update(config)
+    HOLIDAY_RESPONSES.update(holiday_responses)
+    open_run()
+    if HEDGER is not None:
+        HEDGER.tracker.load(hedge_latencies)
+    ACCOUNT_MESSAGES = messages
+    WRITER = QueueWriter(messages)
+
+# Runs in the account worker processes, errors are reported through the
+# messages so they arrive after everything the account emitted.
+def sync_account_in_worker(account, state):
+    use_account(account, state)
+    LOGGER.info("Syncing account {}".format(ACCOUNT_ID))
+
+    error = None
+    try:
+        do_sync()
+    except Exception as exc:  # pylint: disable=broad-except
+        error = str(exc)
+
+    ACCOUNT_MESSAGES.put(("done", ACCOUNT_ID, error))
+
+def check_accounts_config():
+    if not CONFIG.get("auth_token") and not CONFIG.get("accounts"):
+        raise ConfigError("Config is missing required keys: ['auth_token'] or ['accounts']")
+
+    if CONFIG.get("auth_token") and CONFIG.get("accounts"):
+        raise ConfigError("Set either auth_token or accounts, the auth_token of every account is part of its entry")
+
+    if int(CONFIG.get("account_workers", 1)) < 1:
+        raise ConfigError("account_workers must be at least 1")
+
+    account_ids = set()
+    for account in CONFIG.get("accounts", []):
+        if not account.get("account_id") or not account.get("auth_token"):
+            raise ConfigError("Every account needs an account_id and an auth_token")
+        if str(account["account_id"]) in account_ids:
+            raise ConfigError("Duplicate account_id {!r}".format(account["account_id"]))
+        account_ids.add(str(account["account_id"]))
+
 def do_discover():
     print('{"streams":[]}')
 
 def main_impl():
     args = utils.parse_args(REQUIRED_CONFIG_KEYS)
     CONFIG.update(args.config)
+    check_accounts_config()
     global AUTH  # pylint: disable=global-statement
-    AUTH = Auth(CONFIG["auth_token"])
-    global XDFA
-    XDFA = XDFA(CONFIG["x_dfa_token"])
+    AUTH = Auth(CONFIG.get("auth_token"))
+    open_run()
+    if not CONFIG.get("accounts"):
+        open_outputs()
     STATE.update(args.state)
+    if HEDGER is not None:
+        HEDGER.tracker.load(STATE.get("hedge_latencies", {}))
     if args.discover:
         do_discover()
     else:
-        do_sync()
+        global PARSE_POOL  # pylint: disable=global-statement
+        global PARSE_WORKERS  # pylint: disable=global-statement
+        global WRITER  # pylint: disable=global-statement
+        with ExitStack() as resources:
+            if int(CONFIG.get("parse_workers", 1)) > 1:
+                PARSE_WORKERS = int(CONFIG["parse_workers"])
+                PARSE_POOL = resources.enter_context(
+                    ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                        mp_context=get_worker_context(),
+                                        initializer=init_parse_worker,
+                                        initargs=(dict(CONFIG),)))
+            if HEDGER is not None:
+                resources.enter_context(HEDGER)
+            if int(CONFIG.get("writer_queue_depth", 0)) > 0:
+                WRITER = resources.enter_context(
+                    ThreadedWriter(int(CONFIG["writer_queue_depth"])))
+
+            if CONFIG.get("accounts"):
+                sync_accounts(CONFIG["accounts"])
+            else:
+                do_sync()
 
 def main():
     try:
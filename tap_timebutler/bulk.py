@@ -0,0 +1,190 @@
+"""
+Columnar bulk export of the streams to Parquet or Arrow IPC files.
+
+Used for initial loads and backfills: records are written in batches to
+one file per stream, partition (the synced year) and sync call, and only a
+manifest of the written files ends up in the STATE on stdout. Requires
+pyarrow, install with `pip install tap-timebutler[bulk]`.
+"""
+
+import json
+import os
+from collections import defaultdict
+
+FORMATS = {
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+
+class BulkExportError(Exception):
+    pass
+
+
+def get_arrow_type(pa, subschema):
+    types = subschema.get("type", [])
+
+    if "integer" in types:
+        return pa.int64()
+    if "number" in types:
+        return pa.float64()
+    if "boolean" in types:
+        return pa.bool_()
+
+    return pa.string()
+
+
+class BulkExporter:
+    def __init__(self, path, file_format="parquet"):
+        try:
+            import pyarrow  # pylint: disable=import-outside-toplevel
+        except ImportError as exc:
+            raise BulkExportError("Bulk export requires pyarrow, install tap-timebutler[bulk]") from exc
+
+        if file_format not in FORMATS:
+            raise BulkExportError("Unknown bulk export format {!r}, expected one of {}".format(
+                file_format, ", ".join(sorted(FORMATS))))
+
+        self.pa = pyarrow
+        self.path = path
+        self.file_format = file_format
+        self.schemas = {}
+        self.parts = defaultdict(int)
+        self.files = []
+        self.unit = None
+        self.directories = set()
+
+    def add_schema(self, stream, schema):
+        if stream not in self.schemas:
+            self.schemas[stream] = self.pa.schema([
+                (key, get_arrow_type(self.pa, subschema))
+                for key, subschema in schema["properties"].items()
+            ])
+
+    # Parts are numbered per directory, holidays and absences of a year
+    # share one.
+    def get_file(self, stream, partition):
+        directory = os.path.join(self.path, stream)
+        if partition is not None:
+            directory = os.path.join(directory, "year={}".format(partition))
+
+        os.makedirs(directory, exist_ok=True)
+
+        if directory not in self.directories:
+            self.directories.add(directory)
+            self.remove_unlisted_parts(directory)
+
+        part = self.parts[directory]
+        self.parts[directory] += 1
+
+        return os.path.join(directory, "part-{:05d}{}".format(part, FORMATS[self.file_format]))
+
+    # Parts of earlier runs, or partial ones of a crashed run, would be read
+    # by loaders globbing part-*. The first time a run writes to a directory
+    # only the parts listed in its manifest are kept there.
+    def remove_unlisted_parts(self, directory):
+        listed = {os.path.join(self.path, exported_file["path"]) for exported_file in self.files}
+        extension = FORMATS[self.file_format]
+
+        for name in os.listdir(directory):
+            file_name = os.path.join(directory, name)
+            if name.startswith("part-") and name.endswith(extension) and file_name not in listed:
+                os.remove(file_name)
+
+    # A resumed run keeps the files of the units the previous run completed
+    # and numbers its own parts after them.
+    def resume(self):
+        manifest_file = os.path.join(self.path, "manifest.json")
+        if not os.path.exists(manifest_file):
+            return
+
+        with open(manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if manifest.get("format") != self.file_format:
+            raise BulkExportError("Cannot resume a {} bulk export as {}".format(
+                manifest.get("format"), self.file_format))
+
+        self.files = manifest["files"]
+        for exported_file in self.files:
+            directory = os.path.join(self.path, os.path.dirname(exported_file["path"]))
+            part = int(os.path.basename(exported_file["path"]).split(".")[0][len("part-"):])
+            self.parts[directory] = max(self.parts[directory], part + 1)
+
+    # Files of an earlier attempt of the same unit, in this run or the
+    # resumed one, would duplicate its rows.
+    def start_unit(self, unit):
+        self.unit = unit
+
+        for exported_file in self.files:
+            if exported_file.get("unit") == unit:
+                file_name = os.path.join(self.path, exported_file["path"])
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+
+        self.files = [exported_file for exported_file in self.files if exported_file.get("unit") != unit]
+
+    def open_writer(self, file_name, arrow_schema):
+        if self.file_format == "parquet":
+            import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+            return pyarrow.parquet.ParquetWriter(file_name, arrow_schema)
+
+        return self.pa.ipc.new_file(file_name, arrow_schema)
+
+    def write(self, stream, partition, batches):
+        arrow_schema = self.schemas[stream]
+        file_name = None
+        writer = None
+        rows = 0
+
+        try:
+            for batch in batches:
+                if writer is None:
+                    file_name = self.get_file(stream, partition)
+                    writer = self.open_writer(file_name, arrow_schema)
+
+                writer.write_table(self.pa.Table.from_pylist(batch, schema=arrow_schema))
+                rows += len(batch)
+        except Exception:
+            # The partial file of a failed unit is not left behind.
+            if writer is not None:
+                writer.close()
+                os.remove(file_name)
+            raise
+
+        if writer is not None:
+            writer.close()
+
+        if file_name is not None:
+            self.files.append({
+                "unit": self.unit,
+                "stream": stream,
+                "partition": partition,
+                "path": os.path.relpath(file_name, self.path),
+                "rows": rows,
+            })
+
+        return rows
+
+    def write_manifest(self):
+        rows = defaultdict(int)
+        for exported_file in self.files:
+            rows[exported_file["stream"]] += exported_file["rows"]
+
+        manifest = {
+            "format": self.file_format,
+            "files": self.files,
+            "rows": dict(rows),
+        }
+
+        os.makedirs(self.path, exist_ok=True)
+        manifest_file = os.path.join(self.path, "manifest.json")
+        with open(manifest_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        return {
+            "manifest": manifest_file,
+            "format": self.file_format,
+            "files": len(self.files),
+            "rows": dict(rows),
+        }
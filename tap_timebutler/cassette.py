@@ -0,0 +1,111 @@
+"""
+Record and replay of HTTP responses for offline runs and benchmarks.
+
+Every response is stored as one gzip compressed JSON file in the cassette
+directory, named after a digest of the request URL and its parameters.
+Secrets (the Timebutler auth parameter and the holiday API token) are
+never written and are not part of the digest, so a cassette recorded with
+production credentials replays with any placeholder credentials.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+SECRET_PARAMS = {"auth"}
+SECRET_HEADERS = {"x-dfa-token"}
+
+
+class CassetteError(Exception):
+    pass
+
+
+def public_params(params):
+    return {key: str(value) for key, value in params.items() if key not in SECRET_PARAMS}
+
+
+def public_headers(headers):
+    return {key: value for key, value in headers.items() if key.lower() not in SECRET_HEADERS}
+
+
+# Responses of several accounts are kept apart by their scope, responses
+# that are the same for every account are not scoped.
+def cassette_key(url, params, scope=None):
+    request = [url, sorted(public_params(params).items())]
+    if scope is not None:
+        request.append(scope)
+
+    payload = json.dumps(request)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path, mode, shared_urls=()):
+        if mode not in ("record", "replay"):
+            raise CassetteError("Unknown cassette mode {!r}, expected record or replay".format(mode))
+
+        self.path = path
+        self.mode = mode
+        self.scope = None
+        self.shared_urls = tuple(shared_urls)
+
+        if mode == "record":
+            os.makedirs(path, exist_ok=True)
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def get_file(self, url, params):
+        scope = None if url.startswith(self.shared_urls) else self.scope
+        return os.path.join(self.path, cassette_key(url, params, scope) + ".json.gz")
+
+    def record(self, url, params, headers, response):
+        body = response.content
+
+        try:
+            body, body_encoding = body.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            body, body_encoding = base64.b64encode(body).decode("ascii"), "base64"
+
+        entry = {
+            "url": url,
+            "params": public_params(params),
+            "headers": public_headers(headers),
+            "status_code": response.status_code,
+            "response_headers": dict(response.headers),
+            "body": body,
+            "body_encoding": body_encoding,
+        }
+
+        with gzip.open(self.get_file(url, params), "wt", encoding="utf-8") as cassette_file:
+            json.dump(entry, cassette_file)
+
+    def replay(self, url, params):
+        file_name = self.get_file(url, params)
+
+        if not os.path.exists(file_name):
+            raise CassetteError("No recorded response for POST {} {}".format(url, public_params(params)))
+
+        with gzip.open(file_name, "rt", encoding="utf-8") as cassette_file:
+            entry = json.load(cassette_file)
+
+        if entry["body_encoding"] == "base64":
+            body = base64.b64decode(entry["body"])
+        else:
+            body = entry["body"].encode("utf-8")
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = entry["status_code"]
+        response.headers = CaseInsensitiveDict(entry["response_headers"])
+        response.encoding = "utf-8"
+        response._content = body  # pylint: disable=protected-access
+        response._content_consumed = True  # pylint: disable=protected-access
+
+        return response
@@ -0,0 +1,37 @@
+"""
+Parsing of the day-first dates in Timebutler exports.
+
+Exports use dd/mm/yyyy and the same few thousand days repeat across
+millions of rows, so parsed values are cached on the raw string.
+"""
+
+from datetime import date
+from functools import lru_cache
+
+DATE_CACHE_SIZE = 16384
+
+EMPTY_DAY = (None, None)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_day(value):
+    """Parse a dd/mm/yyyy string into a (date, ISO 8601 string) pair."""
+    if not value:
+        return EMPTY_DAY
+
+    day, month, year = value.split("/")
+    parsed = date(int(year), int(month), int(day))
+
+    return parsed, parsed.isoformat()
+
+
+def parse_date(value):
+    return parse_day(value)[0]
+
+
+def to_iso(value):
+    return parse_day(value)[1]
+
+
+def to_iso_column(values):
+    return [None if value is None else parse_day(value)[1] for value in values]
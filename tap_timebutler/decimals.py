@@ -0,0 +1,73 @@
+"""
+Parsing of the numeric columns in Timebutler exports.
+
+Exports write decimals with a comma ("0,5" workdays), larger ones may
+group the thousands with a dot ("1.234,5"). The Transformer of
+singer-python drops commas as thousands separators, which would turn
+"0,5" into 5, so numeric columns are converted while the rows are
+decoded. Accounts exporting a decimal dot set decimal_separator, the
+comma then groups the thousands. Few distinct decimals repeat across the
+rows, so those are cached; integer columns are mostly unique ids and are
+not.
+"""
+
+from functools import lru_cache
+
+NUMBER_CACHE_SIZE = 4096
+
+# Decimal separators and the grouping separator that goes with each.
+GROUPING_SEPARATORS = {",": ".", ".": ","}
+DECIMAL_SEPARATOR = ","
+
+
+def set_decimal_separator(separator):
+    global DECIMAL_SEPARATOR  # pylint: disable=global-statement
+
+    if separator not in GROUPING_SEPARATORS:
+        raise ValueError("Unknown decimal separator {!r}, expected one of {}".format(
+            separator, " ".join(sorted(GROUPING_SEPARATORS))))
+
+    DECIMAL_SEPARATOR = separator
+    to_number.cache_clear()
+
+
+def normalize_number(value, decimal_separator=","):
+    """
+    Rewrites a number with a fixed decimal separator, like "1.234,5", to
+    "1234.5". The other separator only groups thousands, so with a comma
+    "1.500" is 1500 and "0,5" is 0.5.
+    """
+    grouping = GROUPING_SEPARATORS[decimal_separator]
+
+    return value.replace(grouping, "").replace(decimal_separator, ".")
+
+
+@lru_cache(maxsize=NUMBER_CACHE_SIZE)
+def to_number(value):
+    if value is None:
+        return None
+
+    return float(normalize_number(value, DECIMAL_SEPARATOR))
+
+
+def to_integer(value):
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        # Grouped thousands, a decimal still fails.
+        return int(normalize_number(value, DECIMAL_SEPARATOR))
+
+
+# Column variants convert the values of one column of a batch of rows.
+def to_number_column(values):
+    return list(map(to_number, values))
+
+
+def to_integer_column(values):
+    try:
+        return [None if value is None else int(value) for value in values]
+    except ValueError:
+        return list(map(to_integer, values))
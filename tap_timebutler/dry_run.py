@@ -0,0 +1,107 @@
+"""
+Count-only dry runs for sizing loads and measuring parser throughput.
+
+Everything is fetched, parsed and serialized as in a regular sync, but
+instead of writing the Singer messages the report counts per stream and
+year the exported rows, the emitted records (expanded absence days), the
+bytes read and the bytes that would have been written.
+"""
+
+import json
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+
+class DryRunReport:
+    def __init__(self, path=None):
+        self.path = path
+        self.units = []
+        self.current = None
+
+    def start_unit(self, stream, unit_key):
+        self.current = {
+            "stream": stream,
+            "unit": unit_key,
+            "rows": 0,
+            "records": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "seconds": 0.0,
+            "started": time.perf_counter(),
+        }
+
+    def finish_unit(self):
+        unit, self.current = self.current, None
+        unit["seconds"] = time.perf_counter() - unit.pop("started")
+        unit["rows_per_second"] = unit["rows"] / unit["seconds"] if unit["seconds"] else None
+        unit["records_per_second"] = unit["records"] / unit["seconds"] if unit["seconds"] else None
+
+        self.units.append(unit)
+
+        LOGGER.info("Dry run {stream} {unit}: {rows} rows, {records} records, "
+                    "{bytes_in} bytes in, {bytes_out} bytes out, {seconds:.2f}s".format(**unit))
+
+    def count_lines(self, lines):
+        if self.current is None:
+            return lines
+
+        return self.iter_counted_lines(lines)
+
+    def iter_counted_lines(self, lines):
+        unit = self.current
+        header = True
+
+        for line in lines:
+            # Exports are decoded already, umlauts take more than one byte.
+            unit["bytes_in"] += len(line.encode("utf-8")) + 1
+
+            if header:
+                header = False
+            elif line:
+                unit["rows"] += 1
+
+            yield line
+
+    # JSON bodies are counted whole, every holiday is a row.
+    def count_body(self, size, rows):
+        if self.current is None:
+            return
+
+        self.current["bytes_in"] += size
+        self.current["rows"] += rows
+
+    def consume(self, schema_name, records, time_extracted):
+        unit = self.current
+
+        for record in records:
+            message = singer.RecordMessage(stream=schema_name,
+                                           record=record,
+                                           time_extracted=time_extracted)
+
+            unit["records"] += 1
+            unit["bytes_out"] += len(singer.format_message(message)) + 1
+
+    def totals(self):
+        totals = {}
+
+        for unit in self.units:
+            stream = totals.setdefault(unit["stream"], {
+                "rows": 0, "records": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0})
+            for key in stream:
+                stream[key] += unit[key]
+
+        return totals
+
+    def write(self):
+        totals = self.totals()
+
+        for stream, total in totals.items():
+            LOGGER.info("Dry run total {}: {rows} rows, {records} records, {bytes_out} bytes out, "
+                        "{seconds:.2f}s".format(stream, **total))
+
+        if self.path:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"units": self.units, "streams": totals}, f, indent=2)
@@ -0,0 +1,148 @@
+"""
+Batch decoding of export rows with the C parser of pandas.
+
+Lines are parsed in large batches with pandas.read_csv and every column is
+stripped, nulled and converted at once, driven by the converters of the
+row layout. The rows that come out are the same as those of the row by
+row decoder. The engine is opt-in with csv_engine "pandas" and only used
+for the large, mostly numeric worktime export; the tap imports this
+module, and with it pandas, only then.
+"""
+
+import csv
+import io
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from tap_timebutler import decimals
+from tap_timebutler.dates import to_iso
+from tap_timebutler.decimals import to_integer, to_integer_column, to_number, to_number_column
+
+FRAME_CHUNK_LINES = 50000
+
+
+# Few distinct days repeat across a batch, each one is parsed once.
+def convert_dates(values):
+    values = pd.Series(values)
+    return values.map({day: to_iso(day) for day in values.unique()}).to_numpy(dtype=object)
+
+
+# Numbers the C parser left as strings follow the rules of the row decoder.
+COLUMN_CONVERTERS = {
+    to_iso: convert_dates,
+    to_integer: to_integer_column,
+    to_number: to_number_column,
+}
+
+
+# Leading blanks are skipped by the parser, trailing ones only exist when
+# a blank is followed by a separator or the end of a line.
+TRAILING_BLANKS = (" ;", "\t;", " \n", "\t\n")
+
+
+def has_trailing_blanks(text):
+    return text.endswith((" ", "\t")) or any(blank in text for blank in TRAILING_BLANKS)
+
+
+# Numeric columns are parsed by the C parser itself, with the separators
+# of decimal_separator. Empty fields are read as NaN.
+def read_frame(text, layout):
+    numeric = {i for i, converter in layout.converters if converter in (to_integer, to_number)}
+
+    return pd.read_csv(io.StringIO(text),
+                       sep=";",
+                       header=None,
+                       dtype={i: str for i in range(len(layout.properties)) if i not in numeric},
+                       decimal=decimals.DECIMAL_SEPARATOR,
+                       thousands=decimals.GROUPING_SEPARATORS[decimals.DECIMAL_SEPARATOR],
+                       na_values=[""],
+                       keep_default_na=False,
+                       skipinitialspace=True,
+                       quoting=csv.QUOTE_NONE,
+                       engine="c")
+
+
+def decode_numbers(column, converter):
+    values = column.to_numpy()
+
+    if values.dtype.kind == "i":
+        return values.astype(float if converter is to_number else object).astype(object)
+
+    missing = np.isnan(values)
+    if converter is to_integer:
+        if (values[~missing] % 1).any():
+            raise ValueError("Decimal value in integer column {}".format(column.name))
+        decoded = np.where(missing, 0, values).astype(np.int64).astype(object)
+    else:
+        decoded = values.astype(object)
+
+    decoded[missing] = None
+    return decoded
+
+
+def decode_strings(column, converter, strip):
+    if strip:
+        column = column.str.strip()
+
+    values = column.to_numpy(dtype=object)
+    present = pd.notna(values)
+    if strip:
+        present &= values != ""
+
+    # Only the present values are converted, nulls stay None.
+    if converter is not None and present.any():
+        values[present] = COLUMN_CONVERTERS[converter](values[present])
+    values[~present] = None
+
+    return values
+
+
+# Returns the rows as value lists. Columns the export does not have, like
+# the derived ones, stay None.
+def decode_frame(frame, layout, strip):
+    rows = np.full((len(frame), len(layout.properties)), None, dtype=object)
+    converters = dict(layout.converters)
+
+    for i in range(min(frame.shape[1], len(layout.properties))):
+        column = frame[i]
+        converter = converters.get(i)
+
+        # Numeric columns the C parser could not read come as strings and
+        # are converted like the others.
+        if column.dtype.kind in "if":
+            rows[:, i] = decode_numbers(column, converter)
+        else:
+            rows[:, i] = decode_strings(column, converter, strip)
+
+    return rows.tolist()
+
+
+def iter_frame_values(lines, layout, decode_rows, chunk_lines=FRAME_CHUNK_LINES):
+    """
+    Yields the value lists of the rows in lines. A batch the C parser
+    rejects, e.g. for a row with more columns than the schema, is decoded
+    row by row with decode_rows instead.
+    """
+    width = len(layout.properties)
+    lines = iter(lines)
+
+    while True:
+        batch = list(islice(lines, chunk_lines))
+        if not batch:
+            return
+
+        text = "\n".join(batch)
+
+        try:
+            frame = read_frame(text, layout)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError):
+            frame = None
+
+        if frame is None or frame.shape[1] > width:
+            for row in decode_rows(batch, layout):
+                yield row.values
+            continue
+
+        yield from decode_frame(frame, layout, has_trailing_blanks(text))
@@ -0,0 +1,126 @@
+"""
+Hedged requests against slow-tail responses.
+
+The time to the response headers of recent requests is tracked per
+endpoint. Once enough samples exist, a request without headers after the
+configured percentile of those latencies is sent a second time, and
+whichever response arrives first is used. The other one is closed when it
+completes. Endpoints with too few samples use a fixed delay, if one is
+configured, and the samples can be stored between runs.
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import singer
+
+LOGGER = singer.get_logger()
+
+WINDOW = 200
+PERSISTED_SAMPLES = 50
+
+
+class LatencyTracker:
+    def __init__(self, percentile, min_samples, fallback=None):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.fallback = fallback
+        self.samples = defaultdict(lambda: deque(maxlen=WINDOW))
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, seconds):
+        with self.lock:
+            self.samples[endpoint].append(seconds)
+
+    def threshold(self, endpoint):
+        """
+        Returns the latency after which a request to endpoint is hedged.
+        While there are too few samples that is the fallback, None when
+        there is none.
+        """
+        with self.lock:
+            samples = sorted(self.samples[endpoint])
+
+        if len(samples) < self.min_samples:
+            return self.fallback
+
+        rank = math.ceil(self.percentile / 100 * len(samples)) - 1
+
+        return samples[min(max(rank, 0), len(samples) - 1)]
+
+    def load(self, stored):
+        with self.lock:
+            for endpoint, samples in stored.items():
+                self.samples[endpoint].extend(samples)
+
+    def dump(self):
+        """Returns the most recent samples per endpoint, to be stored."""
+        with self.lock:
+            return {
+                endpoint: [round(seconds, 3) for seconds in list(samples)[-PERSISTED_SAMPLES:]]
+                for endpoint, samples in self.samples.items() if samples
+            }
+
+
+class Hedger:
+    """
+    Sends requests through send functions that return once the headers
+    arrived, e.g. a streamed requests send, so the tracked latency does not
+    depend on the size of the body.
+    """
+
+    def __init__(self, percentile, min_samples=20, fallback=None):
+        self.tracker = LatencyTracker(percentile, min_samples, fallback)
+        self.executor = ThreadPoolExecutor(thread_name_prefix="hedge")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def timed(self, endpoint, send):
+        started = time.perf_counter()
+        response = send()
+        self.tracker.add(endpoint, time.perf_counter() - started)
+
+        return response
+
+    def send(self, endpoint, send):
+        threshold = self.tracker.threshold(endpoint)
+
+        if threshold is None:
+            return self.timed(endpoint, send)
+
+        pending = {self.executor.submit(self.timed, endpoint, send)}
+        done, _ = wait(pending, timeout=threshold)
+
+        if not done:
+            LOGGER.info("Hedging request to {} after {:.2f}s".format(endpoint, threshold))
+            pending.add(self.executor.submit(self.timed, endpoint, send))
+
+        # The first response wins, a failed attempt only counts when the
+        # other one failed as well.
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.add_done_callback(close_response)
+                    return future.result()
+
+                error = future.exception()
+
+        raise error
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
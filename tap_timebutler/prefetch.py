@@ -0,0 +1,43 @@
+"""
+Prefetching of the per-year requests.
+
+While the response of one year is parsed and emitted, the requests of the
+next years are already running on a small thread pool. Responses are
+handed out by key, in the order the units consume them.
+"""
+
+from collections import OrderedDict, deque
+
+
+class Prefetcher:
+    def __init__(self, executor, jobs, depth):
+        self.executor = executor
+        self.jobs = deque(jobs)
+        self.depth = depth
+        self.futures = OrderedDict()
+
+    def fill(self, size):
+        while self.jobs and len(self.futures) < size:
+            key, fetch = self.jobs.popleft()
+            self.futures[key] = self.executor.submit(fetch)
+
+    def take(self, key):
+        """
+        Returns the prefetched response for key, or None when it was not
+        prefetched. The next `depth` requests are started before waiting.
+        """
+        self.fill(self.depth + 1)
+        future = self.futures.pop(key, None)
+        self.fill(self.depth)
+
+        if future is None:
+            return None
+
+        return future.result()
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+
+        self.futures.clear()
+        self.jobs.clear()
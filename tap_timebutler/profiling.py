@@ -0,0 +1,141 @@
+"""
+Opt-in profiling of the sync units.
+
+The CPU profiler writes one cProfile file per stream and year, plus a
+summary of the top functions by cumulative time over all units of the
+run. The memory profiler traces allocations with tracemalloc and writes a
+JSON report with the peak and the top allocating lines of every unit.
+"""
+
+import cProfile
+import json
+import os
+import platform
+import pstats
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+SUMMARY_LIMIT = 40
+TOP_ALLOCATIONS = 10
+TRACEBACK_FRAMES = 1
+
+# Allocations of the tracing machinery itself are not interesting.
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+class UnitProfiler:
+    def __init__(self, path):
+        self.path = path
+        self.files = []
+        self.attempts = defaultdict(int)
+
+        os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def profile(self, stream, unit_key):
+        profile = cProfile.Profile()
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+
+            # Retries of a unit get their own file, the summary counts
+            # every attempt once.
+            attempt = self.attempts[(stream, unit_key)]
+            self.attempts[(stream, unit_key)] += 1
+            suffix = "-retry{}".format(attempt) if attempt else ""
+
+            file_name = os.path.join(self.path, "{}-{}{}.prof".format(stream, unit_key, suffix))
+            profile.dump_stats(file_name)
+            self.files.append(file_name)
+
+    def write_summary(self):
+        if not self.files:
+            return None
+
+        file_name = os.path.join(self.path, "summary.txt")
+
+        with open(file_name, "w", encoding="utf-8") as summary:
+            stats = pstats.Stats(self.files[0], stream=summary)
+            for profile_file in self.files[1:]:
+                stats.add(profile_file)
+
+            stats.sort_stats("cumulative").print_stats(SUMMARY_LIMIT)
+
+        return file_name
+
+
+class UnitMemoryProfiler:
+    def __init__(self, path, top=TOP_ALLOCATIONS):
+        self.path = path
+        self.top = top
+        self.units = []
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    @contextmanager
+    def profile(self, stream, unit_key):
+        if hasattr(tracemalloc, "reset_peak"):
+            before = self.take_snapshot()
+            tracemalloc.reset_peak()
+        else:
+            # Before Python 3.9 the peak is only reset by restarting the
+            # tracing, which forgets the earlier allocations as well.
+            tracemalloc.stop()
+            tracemalloc.start(TRACEBACK_FRAMES)
+            before = self.take_snapshot()
+
+        start, _ = tracemalloc.get_traced_memory()
+
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            after = self.take_snapshot()
+
+            self.units.append({
+                "stream": stream,
+                "unit": unit_key,
+                "start_bytes": start,
+                "peak_bytes": peak,
+                "peak_increase_bytes": peak - start,
+                "retained_bytes": current - start,
+                "top_allocations": [
+                    {
+                        "file": stat.traceback[0].filename,
+                        "line": stat.traceback[0].lineno,
+                        "size_bytes": stat.size_diff,
+                        "count": stat.count_diff,
+                    }
+                    for stat in after.compare_to(before, "lineno")[:self.top]
+                ],
+            })
+
+    def write_report(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        report = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "units": self.units,
+        }
+
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+        return self.path
@@ -0,0 +1,433 @@
+"""
+Seeded generator for synthetic Timebutler exports and holiday API responses.
+
+Produces the semicolon separated exports in the column order of the
+stream schemas and the holiday API JSON for N users over M years, with
+long absences, half days, empty fields and absences spanning the turn of
+the year. The same seed always produces the same data.
+
+The responses are written either as cassettes, so a run with
+cassette_mode "replay" syncs them offline, or as plain files for a local
+stand-in server:
+
+    python -m tap_timebutler.synthetic --users 500 --years 5 --cassette-dir cassettes
+"""
+
+import argparse
+import json
+import os
+import random
+from datetime import date, timedelta
+
+import requests
+
+import tap_timebutler as tap
+from tap_timebutler.cassette import Cassette
+
+WEEKLY_MINUTES = [(480,) * 5 + (0, 0), (420,) * 5 + (0, 0), (240,) * 5 + (0, 0),
+                  (480, 480, 480, 480, 0, 0, 0)]
+
+# Absence type, episodes per year, weighted lengths in calendar days.
+ABSENCE_EPISODES = [
+    ("Vacation", 6, [(1, 30), (2, 15), (3, 10), (5, 15), (10, 20), (17, 8), (24, 2)]),
+    ("Sickness", 3, [(1, 40), (2, 25), (3, 15), (5, 12), (14, 5), (42, 3)]),
+    ("Overtime reduction request", 2, [(1, 80), (2, 20)]),
+    ("Berufsschule/Uni", 1, [(1, 60), (5, 40)]),
+    ("miscellaneous", 1, [(1, 100)]),
+]
+ABSENCE_STATES = [("Approved", 90), ("Requested", 6), ("Rejected", 4)]
+
+DEPARTMENTS = ["Development", "Design", "Consulting", "Sales", "Administration", ""]
+OFFICES = ["Berlin", "Leipzig", ""]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner",
+              "Becker", "Schulz", "Hoffmann", "Koch", "Richter", "Klein", "Wolf"]
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannes",
+               "Ida", "Jonas", "Lena", "Mia", "Noah", "Paul", "Sophie", "Tim"]
+PROJECTS = ["Website relaunch", "Mobile app", "Data platform", "Internal", "Support"]
+SERVICES = ["Development", "Design", "Project management", "Meetings"]
+
+ALL_REGIONS = frozenset(tap.HOLIDAY_REGIONS)
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def day_first(day):
+    return day.strftime("%d/%m/%Y") if day else ""
+
+
+def decimal(value):
+    # Timebutler exports decimals with a comma.
+    return "{:g}".format(value).replace(".", ",")
+
+
+def easter(year):
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+
+    return date(year, month, day + 1)
+
+
+def get_holidays(year):
+    easter_sunday = easter(year)
+    holidays = [
+        ("Neujahr", date(year, 1, 1), ALL_REGIONS),
+        ("Heilige Drei Könige", date(year, 1, 6), {"bw", "by", "st"}),
+        ("Internationaler Frauentag", date(year, 3, 8), {"be"} if year >= 2019 else set()),
+        ("Karfreitag", easter_sunday - timedelta(days=2), ALL_REGIONS),
+        ("Ostermontag", easter_sunday + timedelta(days=1), ALL_REGIONS),
+        ("Tag der Arbeit", date(year, 5, 1), ALL_REGIONS),
+        ("Christi Himmelfahrt", easter_sunday + timedelta(days=39), ALL_REGIONS),
+        ("Pfingstmontag", easter_sunday + timedelta(days=50), ALL_REGIONS),
+        ("Fronleichnam", easter_sunday + timedelta(days=60), {"bw", "by", "he", "nw", "rp", "sl"}),
+        ("Tag der Deutschen Einheit", date(year, 10, 3), ALL_REGIONS),
+        ("Reformationstag", date(year, 10, 31), {"bb", "mv", "sn", "st", "th", "hb", "hh", "ni", "sh"}),
+        ("Allerheiligen", date(year, 11, 1), {"bw", "by", "nw", "rp", "sl"}),
+        ("1. Weihnachtstag", date(year, 12, 25), ALL_REGIONS),
+        ("2. Weihnachtstag", date(year, 12, 26), ALL_REGIONS),
+    ]
+
+    return {
+        "holidays": [
+            {"holiday": {
+                "date": day.isoformat(),
+                "name": name,
+                "regions": {region: region in regions for region in tap.HOLIDAY_REGIONS},
+            }}
+            for name, day, regions in holidays
+        ]
+    }
+
+
+class SyntheticTimebutler:
+    def __init__(self, users, years, last_year=None, seed=0):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.last_year = last_year or date.today().year
+        self.first_year = self.last_year - years + 1
+        self.users = [self.make_user(i) for i in range(users)]
+        self.absences = self.make_absences()
+
+    def make_user(self, i):
+        rng = self.rng
+        first_day = date(self.first_year, 1, 1)
+        last_day = date(self.last_year, 12, 31)
+
+        # The tap syncs from the earliest entry date on, nobody joined
+        # before the generated years.
+        entry = first_day
+        if rng.random() < 0.6:
+            entry += timedelta(days=rng.randrange((last_day - first_day).days))
+        separation = None
+        if rng.random() < 0.15:
+            separation = entry + timedelta(days=rng.randrange(90, 2000))
+            if separation > last_day:
+                separation = None
+
+        return {
+            "id": 1000 + i,
+            "last_name": rng.choice(LAST_NAMES),
+            "first_name": rng.choice(FIRST_NAMES),
+            "employee_number": "E{:05d}".format(i + 1),
+            "date_of_entry": entry,
+            "date_of_separation": separation,
+            "birthday": date(rng.randrange(1960, 2003), rng.randrange(1, 13), rng.randrange(1, 29)),
+            "weekly_minutes": rng.choice(WEEKLY_MINUTES),
+            "department": rng.choice(DEPARTMENTS),
+            "branch_office": rng.choice(OFFICES),
+        }
+
+    # Exports draw from their own generator, so they come out the same in
+    # whatever order and how often they are written.
+    def export_rng(self, *key):
+        return random.Random("-".join(str(part) for part in (self.seed,) + key))
+
+    def employed(self, user, day):
+        return user["date_of_entry"] <= day and (
+            user["date_of_separation"] is None or day <= user["date_of_separation"])
+
+    def make_absences(self):
+        rng = self.rng
+        absences = []
+
+        for user in self.users:
+            for year in range(self.first_year, self.last_year + 1):
+                for absence_type, episodes, lengths in ABSENCE_EPISODES:
+                    for _ in range(rng.randrange(episodes + 1)):
+                        day_from = date(year, 1, 1) + timedelta(days=rng.randrange(365))
+                        days = weighted(rng, lengths)
+                        absences.append(self.make_absence(user, absence_type, day_from, days))
+
+                # Vacations over the turn of the year show up in the
+                # exports of both years.
+                if rng.random() < 0.2:
+                    day_from = date(year, 12, rng.randrange(20, 30))
+                    absences.append(self.make_absence(user, "Vacation", day_from, rng.randrange(5, 16)))
+
+        absences = [absence for absence in absences if self.employed(absence["user"], absence["day_from"])]
+        absences.sort(key=lambda absence: (absence["day_from"], absence["user"]["id"]))
+
+        for i, absence in enumerate(absences):
+            absence["id"] = 10000 + i
+
+        return absences
+
+    def make_absence(self, user, absence_type, day_from, days):
+        rng = self.rng
+        day_to = day_from + timedelta(days=days - 1)
+        half_a_day = days == 1 and rng.random() < 0.15
+        workdays = sum(1 for i in range(days) if (day_from + timedelta(days=i)).weekday() < 5)
+        workdays = 0.5 if half_a_day and workdays else workdays
+
+        return {
+            "user": user,
+            "day_from": day_from,
+            "day_to": day_to,
+            "half_a_day": half_a_day,
+            "morning": half_a_day and rng.random() < 0.5,
+            "absence_type": absence_type,
+            "extra_vacation_day": absence_type == "Vacation" and rng.random() < 0.02,
+            "absence_state": weighted(rng, ABSENCE_STATES),
+            "workdays": workdays,
+            "medical_certificate": "yes" if absence_type == "Sickness" and days > 3 else "",
+            "comments": rng.choice(["", "", "", "Doctor", "Family", "Trip"]),
+            "substitute": rng.choice(self.users)["id"] if self.users and rng.random() < 0.3 else "",
+        }
+
+    def absences_export(self, year):
+        lines = [header("absences")]
+
+        for absence in self.absences:
+            if absence["day_from"].year > year or absence["day_to"].year < year:
+                continue
+
+            user = absence["user"]
+            hours = absence["workdays"] * max(user["weekly_minutes"]) / 60
+            lines.append(";".join([
+                str(absence["id"]),
+                day_first(absence["day_from"]),
+                day_first(absence["day_to"]),
+                str(absence["half_a_day"]).lower(),
+                str(absence["morning"]).lower(),
+                str(user["id"]),
+                user["employee_number"],
+                absence["absence_type"],
+                str(absence["extra_vacation_day"]).lower(),
+                absence["absence_state"],
+                "",
+                decimal(absence["workdays"]),
+                decimal(hours),
+                absence["medical_certificate"],
+                absence["comments"],
+                str(absence["substitute"]),
+            ]))
+
+        return lines
+
+    def users_export(self):
+        lines = [header("users")]
+
+        for user in self.users:
+            lines.append(";".join([
+                str(user["id"]),
+                user["last_name"],
+                user["first_name"],
+                user["employee_number"],
+                "{}.{}@example.com".format(user["first_name"], user["last_name"]).lower(),
+                "" if user["id"] % 3 else "+49 30 1234{}".format(user["id"]),
+                "",
+                "",
+                user["branch_office"],
+                user["department"],
+                "Employee",
+                "de",
+                "" if user["id"] % 10 else str(self.users[0]["id"]),
+                str(user["date_of_separation"] is not None).lower(),
+                "",
+                day_first(user["date_of_entry"]),
+                day_first(user["date_of_separation"]),
+                day_first(user["birthday"]),
+            ]))
+
+        return lines
+
+    def holidayentitlement_export(self, year):
+        lines = [header("holidayentitlement")]
+        rng = self.export_rng("holidayentitlement", year)
+
+        for user in self.users:
+            if not any(self.employed(user, date(year, month, 1)) for month in range(1, 13)):
+                continue
+
+            contingent = rng.choice([25, 28, 30, 30, 30])
+            lines.append(";".join([
+                str(user["id"]),
+                str(contingent),
+                decimal(rng.randrange(0, contingent * 2) / 2),
+                str(rng.choice([0, 0, 0, 1, 2])),
+                "0" if user["id"] % 40 else "5",
+                "0",
+                "",
+            ]))
+
+        return lines
+
+    def workdays_export(self):
+        lines = [header("workdays")]
+        rng = self.export_rng("workdays")
+
+        for user in self.users:
+            valid_from = user["date_of_entry"]
+            changes = [user["weekly_minutes"]] + [rng.choice(WEEKLY_MINUTES)
+                                                   for _ in range(rng.randrange(3))]
+            for weekly_minutes in changes:
+                lines.append(";".join([str(user["id"]), day_first(valid_from)]
+                                      + [str(minutes) for minutes in weekly_minutes]))
+                valid_from += timedelta(days=rng.randrange(180, 900))
+
+        return lines
+
+    def worktime_export(self):
+        lines = [header("worktime")]
+        rng = self.export_rng("worktime")
+        first_day = date(self.first_year, 1, 1)
+        last_day = date(self.last_year, 12, 31)
+        entry_id = 1
+
+        for user in self.users:
+            day = max(first_day, user["date_of_entry"])
+            end = min(last_day, user["date_of_separation"] or last_day)
+
+            while day <= end:
+                minutes = user["weekly_minutes"][day.weekday()]
+                if minutes and rng.random() < 0.85:
+                    start = 7 * 60 + rng.randrange(0, 180, 15)
+                    pause = 30 if minutes > 360 else 0
+                    lines.append(";".join([
+                        str(entry_id),
+                        str(user["id"]),
+                        day_first(day),
+                        "{:02d}:{:02d}".format(*divmod(start, 60)),
+                        "{:02d}:{:02d}".format(*divmod(start + minutes + pause, 60)),
+                        str(minutes * 60),
+                        str(pause * 60),
+                        "Done" if day.year < self.last_year else rng.choice(["Done", "Open"]),
+                        str(rng.randrange(1, len(PROJECTS) + 1)),
+                        str(rng.randrange(1, len(SERVICES) + 1)),
+                        rng.choice(["", "", "Review", "Planning"]),
+                    ]))
+                    entry_id += 1
+                day += timedelta(days=1)
+
+        return lines
+
+    def projects_export(self):
+        return [header("projects")] + [
+            "{};{};{};{};;{}".format(i + 1, name, "active" if i else "archived",
+                                      decimal(100 * (i + 1)), day_first(date(self.first_year, 1, 1)))
+            for i, name in enumerate(PROJECTS)
+        ]
+
+    def services_export(self):
+        return [header("services")] + [
+            "{};{};active;{};;{}".format(i + 1, name, "yes" if i < 3 else "no",
+                                         day_first(date(self.first_year, 1, 1)))
+            for i, name in enumerate(SERVICES)
+        ]
+
+    def responses(self):
+        """
+        Yields (url, params, body) for every request of a sync of the
+        generated years, params without the auth token.
+        """
+        def export(lines):
+            return ("\n".join(lines) + "\n").encode("utf-8")
+
+        yield tap.get_url("users"), {}, export(self.users_export())
+        yield tap.get_url("workdays"), {}, export(self.workdays_export())
+        yield tap.get_url("worktime"), {}, export(self.worktime_export())
+        yield tap.get_url("projects"), {}, export(self.projects_export())
+        yield tap.get_url("services"), {}, export(self.services_export())
+
+        for year in range(self.first_year, self.last_year + 1):
+            yield tap.get_url("absences"), {"year": year}, export(self.absences_export(year))
+            yield tap.get_url("holidayentitlement"), {"year": year}, export(self.holidayentitlement_export(year))
+            yield tap.get_holiday_url(str(year)), {}, json.dumps(get_holidays(year)).encode("utf-8")
+
+
+def header(schema_name):
+    return ";".join(key for key in tap.load_schema(schema_name)["properties"]
+                    if key not in EXPORT_EXCLUDED)
+
+
+# Columns the tap derives, they are not part of the exports.
+EXPORT_EXCLUDED = {"the_day", "absence_shorthandle", "absence_id", "source_id"}
+
+
+def make_response(url, body):
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json" if url.startswith(tap.HOLIDAY_API_URL) else "text/csv"
+    response._content = body  # pylint: disable=protected-access
+
+    return response
+
+
+def write_cassettes(generator, path, account_id=None):
+    cassette = Cassette(path, "record", shared_urls=(tap.HOLIDAY_API_URL,))
+    cassette.scope = account_id
+
+    for url, params, body in generator.responses():
+        cassette.record(url, params, {}, make_response(url, body))
+
+
+# Plain files for a stand-in server, one per request.
+def write_files(generator, path):
+    os.makedirs(path, exist_ok=True)
+
+    for url, params, body in generator.responses():
+        name = url.rstrip("/").rsplit("/", 1)[-1]
+        if url.startswith(tap.HOLIDAY_API_URL):
+            name = "holidays-{}.json".format(name)
+        elif "year" in params:
+            name = "{}-{}.csv".format(name, params["year"])
+        else:
+            name = "{}.csv".format(name)
+
+        with open(os.path.join(path, name), "wb") as f:
+            f.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Timebutler exports.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--last-year", type=int, help="last generated year, defaults to the current one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cassette-dir", help="write the responses as cassettes for cassette_mode replay")
+    parser.add_argument("--files-dir", help="write the responses as plain files")
+    parser.add_argument("--account-id", help="write the cassettes for this account of a multi-account config")
+    args = parser.parse_args(argv)
+
+    if not args.cassette_dir and not args.files_dir:
+        parser.error("one of --cassette-dir or --files-dir is required")
+
+    generator = SyntheticTimebutler(args.users, args.years, args.last_year, args.seed)
+
+    if args.cassette_dir:
+        write_cassettes(generator, args.cassette_dir, args.account_id)
+    if args.files_dir:
+        write_files(generator, args.files_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Background output stage for the Singer messages.
+
+Serialized messages are handed to a writer thread through a bounded
+queue, so downloading, parsing and serialization continue while a slow
+target is still reading stdout. The producer only blocks when the queue
+is full.
+"""
+
+import queue
+import sys
+import threading
+
+STOP = None
+
+
+class WriterError(Exception):
+    pass
+
+
+class ThreadedWriter:
+    def __init__(self, depth, out=None):
+        self.queue = queue.Queue(maxsize=depth)
+        self.out = out or sys.stdout
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="singer-writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(raise_error=exc_type is None)
+
+    def run(self):
+        while True:
+            text = self.queue.get()
+            if text is STOP:
+                break
+
+            # After a failed write the queue is still drained so that the
+            # producer never blocks on a full queue.
+            if self.error is not None:
+                continue
+
+            try:
+                self.out.write(text)
+                if self.queue.empty():
+                    self.out.flush()
+            except Exception as exc:
+                self.error = exc
+
+        if self.error is None:
+            try:
+                self.out.flush()
+            except Exception as exc:
+                self.error = exc
+
+    def raise_error(self):
+        if self.error is not None:
+            raise WriterError("Writing to stdout failed: {}".format(self.error)) from self.error
+
+    def write(self, text):
+        self.raise_error()
+        self.queue.put(text)
+
+    def close(self, raise_error=True):
+        self.queue.put(STOP)
+        self.thread.join()
+
+        if raise_error:
+            self.raise_error()
+
+
+class QueueWriter:
+    """
+    Output of an account worker process, the serialized messages are put
+    on a multiprocessing queue read by the process that writes stdout.
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def write(self, text):
+        self.messages.put(("text", text))
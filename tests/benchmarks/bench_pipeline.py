@@ -0,0 +1,389 @@
+"""
+Micro-benchmarks for the stages of the sync pipeline.
+
+Every stage runs on synthetic rows shaped like the stream schemas, offline
+and without a target. Timings are divided by the timing of a fixed
+reference workload of the same run, so they compare across machines of
+different speed. A stage is reported as a regression when its relative
+timing is higher than the baseline by more than the threshold in two
+measurements in a row.
+
+    python tests/benchmarks/bench_pipeline.py              # compare
+    python tests/benchmarks/bench_pipeline.py --save       # new baseline
+    python tests/benchmarks/bench_pipeline.py -k absences  # some stages
+
+The threshold defaults to BENCH_THRESHOLD from the environment, so noisy
+CI machines can allow for more.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import date, timedelta
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, PACKAGE_DIR)
+
+import singer  # noqa: E402
+from singer import Transformer  # noqa: E402
+
+import tap_timebutler as tap  # noqa: E402
+from tap_timebutler.frames import iter_frame_values  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+ROWS = 2000
+REPEAT = 5
+THRESHOLD = float(os.environ.get("BENCH_THRESHOLD", 0.5))
+
+SCHEMAS = ["absence_ranges", "absences", "daily_worktime", "holidayentitlement",
+           "projects", "services", "users", "workdays", "worktime"]
+
+# Streams read from a CSV export, derived columns are not part of it.
+EXPORTS = ["absences", "holidayentitlement", "projects", "services", "users", "worktime"]
+DERIVED_COLUMNS = {"the_day", "absence_shorthandle", "absence_id", "source_id",
+                   "day_count", "workday_count"}
+
+DAY_FIRST_COLUMNS = {"day_from", "day_to", "date_of_entry", "date_of_separation",
+                     "birthday", "valid_from", "date_date", "creation_date"}
+
+ABSENCE_TYPES = list(tap.DEFAULT_ABSENCE_TYPES)
+
+
+def get_types(subschema):
+    types = subschema["type"]
+    return types if isinstance(types, list) else [types]
+
+
+# Values as they appear in an export, before any decoding.
+def make_export_value(key, subschema, i):
+    first_day = date(2021, 1, 1) + timedelta(days=i % 365)
+
+    if key in DAY_FIRST_COLUMNS:
+        day = first_day + timedelta(days=i % 3) if key == "day_to" else first_day
+        return day.strftime("%d/%m/%Y")
+    if key == "absence_type":
+        return ABSENCE_TYPES[i % len(ABSENCE_TYPES)]
+    if key == "absence_state":
+        return "Approved"
+    if i % 7 == 0 and key != "id":
+        return ""
+
+    types = get_types(subschema)
+    if "boolean" in types:
+        return "true" if i % 2 else "false"
+    if "integer" in types:
+        return str(i + 1)
+    if "number" in types:
+        # Timebutler writes decimals with a comma and groups thousands.
+        if i % 11 == 0:
+            return "1.{:03d},{}".format(i % 1000, i % 10)
+        return "{},{}".format(i % 480, i % 10)
+    if subschema.get("format") == "date-time":
+        return first_day.isoformat()
+
+    return "{} {}".format(key, i % 97)
+
+
+def make_lines(schema_name, rows=ROWS):
+    schema = tap.load_schema(schema_name)
+    columns = [(key, subschema) for key, subschema in schema["properties"].items()
+               if key not in DERIVED_COLUMNS]
+
+    yield ";".join(key for key, _ in columns)
+    for i in range(rows):
+        yield ";".join(make_export_value(key, subschema, i) for key, subschema in columns)
+
+
+# Records as they are handed to the Transformer.
+def make_records(schema_name, rows=ROWS):
+    schema = tap.load_schema(schema_name)
+
+    if schema_name in EXPORTS:
+        layout = tap.RowLayout(schema)
+        return [row.as_dict() for row in tap.iter_export_rows(make_lines(schema_name, rows), layout)]
+
+    records = []
+    for i in range(rows):
+        record = {}
+        for key, subschema in schema["properties"].items():
+            value = make_export_value(key, subschema, i)
+            if subschema.get("format") in ("date", "date-time") or key in DAY_FIRST_COLUMNS:
+                value = (date(2021, 1, 1) + timedelta(days=i % 365)).isoformat()
+            record[key] = value or None
+        records.append(record)
+
+    return records
+
+
+def transform_all(schema_name, records):
+    schema = tap.load_schema(schema_name)
+    with Transformer() as transformer:
+        return [transformer.transform(record, schema) for record in records]
+
+
+# A benchmark is a setup returning the arguments of the timed function,
+# setup runs again before every repetition so stages that mutate their
+# input start from fresh rows.
+def bench_decode_rows(schema_name):
+    layout = tap.RowLayout(tap.load_schema(schema_name))
+
+    def setup():
+        return (list(make_lines(schema_name)),)
+
+    def run(lines):
+        for _ in tap.iter_export_rows(lines, layout):
+            pass
+
+    return setup, run
+
+
+def bench_decode_frames(schema_name):
+    layout = tap.RowLayout(tap.load_schema(schema_name))
+
+    def setup():
+        return (list(make_lines(schema_name))[1:],)
+
+    def run(lines):
+        for _ in iter_frame_values(lines, layout, tap.iter_rows):
+            pass
+
+    return setup, run
+
+
+def bench_handle_absence_types():
+    values = [ABSENCE_TYPES[i % len(ABSENCE_TYPES)] for i in range(ROWS)]
+
+    def setup():
+        return (values,)
+
+    def run(values):
+        for value in values:
+            tap.handle_absence_types(value, "absence_shorthandle")
+            tap.handle_absence_types(value, "absence_id")
+
+    return setup, run
+
+
+def bench_expand_absences():
+    schema = tap.load_schema("absences")
+    layout = tap.RowLayout(schema)
+
+    def setup():
+        return (list(tap.iter_export_rows(list(make_lines("absences")), layout)),)
+
+    def run(rows):
+        with Transformer() as transformer:
+            for _ in tap.iter_absence_records(rows, schema, transformer):
+                pass
+
+    return setup, run
+
+
+# Ranges are decoded from the absences export, as sync_absence_ranges does.
+def bench_absence_ranges():
+    schema = tap.load_schema("absence_ranges")
+    layout = tap.RowLayout(tap.load_schema("absences"))
+
+    def setup():
+        return (list(tap.iter_export_rows(list(make_lines("absences")), layout)),)
+
+    def run(rows):
+        with Transformer() as transformer:
+            for _ in tap.iter_absence_range_records(rows, schema, transformer):
+                pass
+
+    return setup, run
+
+
+def bench_transform(schema_name):
+    schema = tap.load_schema(schema_name)
+
+    def setup():
+        return ([dict(record) for record in make_records(schema_name)],)
+
+    def run(records):
+        with Transformer() as transformer:
+            for record in records:
+                transformer.transform(record, schema)
+
+    return setup, run
+
+
+def bench_serialize(schema_name):
+    records = transform_all(schema_name, make_records(schema_name))
+    time_extracted = singer.utils.now()
+
+    def setup():
+        return (records,)
+
+    def run(records):
+        "".join(
+            singer.format_message(singer.RecordMessage(stream=schema_name,
+                                                       record=record,
+                                                       time_extracted=time_extracted)) + "\n"
+            for record in records)
+
+    return setup, run
+
+
+# Plain Python splitting, converting and serializing that does not change
+# with the tap. Stages are stored as multiples of it.
+def bench_reference():
+    lines = ["{};{};name {};{},5".format(i, i % 31, i % 97, i % 480) for i in range(ROWS)]
+
+    def setup():
+        return (lines,)
+
+    def run(lines):
+        for line in lines:
+            values = line.split(";")
+            json.dumps({"id": int(values[0]), "day": int(values[1]), "name": values[2],
+                        "hours": float(values[3].replace(",", "."))})
+
+    return setup, run
+
+
+def get_benchmarks():
+    benchmarks = {}
+
+    for schema_name in EXPORTS:
+        benchmarks["decode_rows[{}]".format(schema_name)] = lambda s=schema_name: bench_decode_rows(s)
+
+    # Absences are not decoded by the pandas csv_engine, they show why.
+    for schema_name in ("absences", "worktime"):
+        benchmarks["decode_frames[{}]".format(schema_name)] = lambda s=schema_name: bench_decode_frames(s)
+
+    benchmarks["handle_absence_types"] = bench_handle_absence_types
+    benchmarks["expand_absences"] = bench_expand_absences
+    benchmarks["absence_ranges"] = bench_absence_ranges
+
+    for schema_name in SCHEMAS:
+        benchmarks["transform[{}]".format(schema_name)] = lambda s=schema_name: bench_transform(s)
+
+    for schema_name in SCHEMAS:
+        benchmarks["serialize[{}]".format(schema_name)] = lambda s=schema_name: bench_serialize(s)
+
+    return benchmarks
+
+
+# The fastest repetition is the least disturbed one, it is reported in
+# microseconds per row.
+def measure(benchmark, repeat=REPEAT):
+    setup, run = benchmark()
+    timings = []
+
+    for _ in range(repeat):
+        args = setup()
+        timings.append(timeit.timeit(lambda: run(*args), number=1))
+
+    return min(timings) / ROWS * 1e6
+
+
+# Every stage is divided by the faster of the reference timings taken
+# right before and after it, machines change speed during a run.
+def measure_stages(benchmarks, repeat):
+    reference = measure(bench_reference, repeat)
+    results, references = {}, []
+
+    for name, benchmark in benchmarks.items():
+        results[name] = measure(benchmark, repeat)
+
+        after = measure(bench_reference, repeat)
+        references.append(min(reference, after))
+        reference = after
+
+    return results, references
+
+
+def compare(results, references, baseline, threshold):
+    report = []
+
+    for (name, micros), reference in zip(results.items(), references):
+        relative = micros / reference
+        previous = baseline.get(name)
+        ratio = relative / previous if previous else None
+        report.append({
+            "name": name,
+            "us_per_row": round(micros, 3),
+            "reference_us_per_row": round(reference, 3),
+            "relative": round(relative, 4),
+            "baseline_relative": previous,
+            "ratio": round(ratio, 3) if ratio is not None else None,
+            "regression": ratio is not None and ratio > 1 + threshold,
+        })
+
+    return report
+
+
+def print_report(report, threshold, out=sys.stdout):
+    out.write("{:<42} {:>10} {:>10} {:>10} {:>10} {:>8}\n".format(
+        "stage", "us/row", "reference", "relative", "baseline", "ratio"))
+
+    for entry in report:
+        out.write("{:<42} {:>10.3f} {:>10.3f} {:>10.4f} {:>10} {:>8} {}\n".format(
+            entry["name"],
+            entry["us_per_row"],
+            entry["reference_us_per_row"],
+            entry["relative"],
+            "-" if entry["baseline_relative"] is None else "{:.4f}".format(entry["baseline_relative"]),
+            "-" if entry["ratio"] is None else "{:.2f}".format(entry["ratio"]),
+            "REGRESSION" if entry["regression"] else ""))
+
+    regressions = sum(entry["regression"] for entry in report)
+    out.write("{} of {} stages slower than the baseline by more than {:.0%}\n".format(
+        regressions, len(report), threshold))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-k", dest="keyword", help="only run stages whose name contains this")
+    parser.add_argument("--save", action="store_true", help="store the timings as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--report", help="also write the comparison as JSON to this file")
+    args = parser.parse_args(argv)
+
+    benchmarks = {name: benchmark for name, benchmark in get_benchmarks().items()
+                  if not args.keyword or args.keyword in name}
+    results, references = measure_stages(benchmarks, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    report = compare(results, references, baseline, args.threshold)
+
+    # A single slow measurement is as often the machine as the tap, stages
+    # over the threshold are measured again and only reported as a
+    # regression when they are slower the second time as well.
+    suspects = {entry["name"]: benchmarks[entry["name"]] for entry in report if entry["regression"]}
+    if suspects:
+        rechecked = {entry["name"]: entry for entry in compare(
+            *measure_stages(suspects, args.repeat), baseline, args.threshold)}
+        for entry in report:
+            if entry["name"] in rechecked:
+                entry["recheck_ratio"] = rechecked[entry["name"]]["ratio"]
+                entry["regression"] = rechecked[entry["name"]]["regression"]
+
+    print_report(report, args.threshold)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save:
+        baseline.update({entry["name"]: entry["relative"] for entry in report})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return 0
+
+    return 1 if any(entry["regression"] for entry in report) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Test the absence type catalogue, the unknown_absence_types policies and
+the check of the absence type config.
+"""
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import tap_timebutler as tap  # noqa: E402
+
+CUSTOM_TYPE = {"absence_shorthandle": "SAB", "absence_id": 200}
+
+
+class AbsenceTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        tap.CONFIG.clear()
+        tap.UNKNOWN_ABSENCE_TYPES.clear()
+        # Cleanups run last in first out, the catalogue is rebuilt from an
+        # empty config.
+        self.addCleanup(tap.load_absence_types)
+        self.addCleanup(tap.CONFIG.clear)
+
+    def load(self, **config):
+        tap.CONFIG.update(config)
+        tap.load_absence_types()
+
+    def test_known_types_resolve_to_the_catalogue(self):
+        self.load()
+
+        self.assertEqual(tap.resolve_absence_type("Vacation"), tap.DEFAULT_ABSENCE_TYPES["Vacation"])
+        self.assertEqual(tap.handle_absence_types("Sickness", "absence_id"), 102)
+
+    def test_config_types_extend_and_override_the_built_in_ones(self):
+        self.load(absence_types={"Sabbatical": CUSTOM_TYPE, "Vacation": CUSTOM_TYPE})
+
+        self.assertEqual(tap.resolve_absence_type("Sabbatical"), CUSTOM_TYPE)
+        self.assertEqual(tap.resolve_absence_type("Vacation"), CUSTOM_TYPE)
+        self.assertEqual(tap.resolve_absence_type("Sickness"), tap.DEFAULT_ABSENCE_TYPES["Sickness"])
+
+    def test_unknown_types_use_the_default_type(self):
+        self.load()
+
+        with self.assertLogs(tap.LOGGER, "WARNING") as logs:
+            self.assertEqual(tap.resolve_absence_type("Sabbatical"), tap.DEFAULT_ABSENCE_TYPE)
+            self.assertEqual(tap.resolve_absence_type("Sabbatical"), tap.DEFAULT_ABSENCE_TYPE)
+
+        # Warned about once per run.
+        self.assertEqual(len(logs.output), 1)
+
+    def test_unknown_types_use_the_configured_default_type(self):
+        self.load(default_absence_type=CUSTOM_TYPE)
+
+        with self.assertLogs(tap.LOGGER, "WARNING"):
+            self.assertEqual(tap.handle_absence_types("Sabbatical", "absence_shorthandle"), "SAB")
+
+    def test_unknown_types_are_skipped(self):
+        self.load(unknown_absence_types="skip")
+
+        with self.assertLogs(tap.LOGGER, "WARNING"):
+            self.assertIsNone(tap.resolve_absence_type("Sabbatical"))
+        self.assertIsNone(tap.handle_absence_types("Sabbatical", "absence_id"))
+
+    def test_unknown_types_fail(self):
+        self.load(unknown_absence_types="fail")
+
+        with self.assertRaises(tap.UnknownAbsenceTypeError):
+            tap.resolve_absence_type("Sabbatical")
+
+    def test_valid_config_passes(self):
+        tap.CONFIG.update(unknown_absence_types="skip", absence_types={"Sabbatical": CUSTOM_TYPE},
+                          default_absence_type=CUSTOM_TYPE)
+
+        tap.check_absence_types_config()
+
+    def test_invalid_policy_is_rejected(self):
+        tap.CONFIG.update(unknown_absence_types="ignore")
+
+        with self.assertRaisesRegex(tap.ConfigError, "unknown_absence_types"):
+            tap.check_absence_types_config()
+
+    def test_incomplete_absence_type_is_rejected(self):
+        tap.CONFIG.update(absence_types={"Sabbatical": {"absence_shorthandle": "SAB"}})
+
+        with self.assertRaisesRegex(tap.ConfigError, "Sabbatical"):
+            tap.check_absence_types_config()
+
+    def test_malformed_default_absence_type_is_rejected(self):
+        tap.CONFIG.update(default_absence_type="UNK")
+
+        with self.assertRaisesRegex(tap.ConfigError, "default_absence_type"):
+            tap.check_absence_types_config()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Test the per-unit checkpoints a resumed run continues from.
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import tap_timebutler as tap  # noqa: E402
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        tap.CONFIG.clear()
+        tap.STATE.clear()
+        tap.AUTH = tap.Auth("token")
+
+        patcher = mock.patch.object(tap, "write_state")
+        self.write_state = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(tap.STATE.clear)
+
+    def test_a_unit_is_checkpointed_once(self):
+        tap.mark_unit_completed("absences", 2021)
+        tap.mark_unit_completed("absences", 2021)
+        tap.mark_unit_completed("users", None)
+
+        self.assertEqual(tap.STATE["checkpoints"], {"absences": ["2021"], "users": ["all"]})
+
+    def test_a_completed_unit_is_checkpointed_and_the_state_written(self):
+        sync = mock.Mock()
+
+        tap.sync_unit("absences", 2021, sync, "2021")
+
+        sync.assert_called_once_with("2021")
+        self.assertTrue(tap.is_unit_completed("absences", 2021))
+        self.write_state.assert_called_once_with()
+
+    def test_resume_skips_completed_units(self):
+        tap.mark_unit_completed("absences", 2021)
+        sync = mock.Mock()
+
+        tap.sync_unit("absences", 2021, sync)
+        tap.sync_unit("absences", 2022, sync)
+
+        self.assertEqual(sync.call_count, 1)
+        self.assertEqual(tap.STATE["checkpoints"]["absences"], ["2021", "2022"])
+
+    def test_units_that_are_not_resumable_run_again(self):
+        tap.mark_unit_completed("holidays", 2021)
+        sync = mock.Mock()
+
+        tap.sync_unit("holidays", 2021, sync, resumable=False)
+
+        sync.assert_called_once_with()
+        self.assertEqual(tap.STATE["checkpoints"]["holidays"], ["2021"])
+
+    def test_a_failed_unit_is_not_checkpointed(self):
+        with self.assertRaises(ValueError):
+            tap.sync_unit("absences", 2021, mock.Mock(side_effect=ValueError("bad row")))
+
+        self.assertFalse(tap.is_unit_completed("absences", 2021))
+        self.write_state.assert_not_called()
+
+    def test_completed_units_are_not_prefetched(self):
+        tap.mark_unit_completed("absences", 2021)
+
+        jobs = tap.get_export_jobs("absences", [2021, 2022])
+
+        self.assertEqual([key for key, _ in jobs],
+                         [tap.get_request_key(tap.get_url("absences"), {"year": 2022})])
+
+
+if __name__ == "__main__":
+    unittest.main()
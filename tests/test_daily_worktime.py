@@ -0,0 +1,102 @@
+"""
+Test the planned, absent and booked seconds of the daily_worktime index.
+"""
+import os
+import sys
+import unittest
+from datetime import date
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from tap_timebutler import DailyWorktimeIndex  # noqa: E402
+
+# Eight hours from Monday to Friday.
+FULL_TIME = [28800] * 5 + [0, 0]
+HALF_TIME = [14400] * 5 + [0, 0]
+
+
+def rows_by_day(index):
+    return {row["the_day"]: row for row in index.rows()}
+
+
+class DailyWorktimeIndexTest(unittest.TestCase):
+
+    def test_half_day_absence_counts_half_the_planned_time(self):
+        index = DailyWorktimeIndex(date(2022, 3, 7), date(2022, 3, 7))
+        index.add_workdays(1, date(2022, 1, 1), FULL_TIME)
+        index.add_absence(1, date(2022, 3, 7), True)
+
+        row = rows_by_day(index)["2022-03-07"]
+
+        self.assertEqual(row["expected_seconds"], 28800)
+        self.assertEqual(row["absent_seconds"], 14400)
+
+    def test_overlapping_absences_count_a_day_once(self):
+        index = DailyWorktimeIndex(date(2022, 3, 7), date(2022, 3, 8))
+        index.add_workdays(1, date(2022, 1, 1), FULL_TIME)
+        index.add_absence(1, date(2022, 3, 7), False)
+        index.add_absence(1, date(2022, 3, 7), False)
+        index.add_absence(1, date(2022, 3, 8), True)
+        index.add_absence(1, date(2022, 3, 8), True)
+
+        rows = rows_by_day(index)
+
+        self.assertEqual(rows["2022-03-07"]["absent_seconds"], 28800)
+        self.assertEqual(rows["2022-03-08"]["absent_seconds"], 14400)
+
+    def test_full_day_absence_wins_over_half_day(self):
+        index = DailyWorktimeIndex(date(2022, 3, 7), date(2022, 3, 7))
+        index.add_workdays(1, date(2022, 1, 1), FULL_TIME)
+        index.add_absence(1, date(2022, 3, 7), False)
+        index.add_absence(1, date(2022, 3, 7), True)
+
+        self.assertEqual(rows_by_day(index)["2022-03-07"]["absent_seconds"], 28800)
+
+    def test_holiday_is_fully_absent(self):
+        index = DailyWorktimeIndex(date(2022, 3, 7), date(2022, 3, 7))
+        index.add_workdays(1, date(2022, 1, 1), FULL_TIME)
+        index.add_holiday(date(2022, 3, 7))
+        index.add_absence(1, date(2022, 3, 7), True)
+
+        self.assertEqual(rows_by_day(index)["2022-03-07"]["absent_seconds"], 28800)
+
+    def test_rows_span_the_year_boundary(self):
+        index = DailyWorktimeIndex(date(2021, 12, 30), date(2022, 1, 3))
+        index.add_workdays(1, date(2021, 1, 1), FULL_TIME)
+        index.add_workdays(1, date(2022, 1, 1), HALF_TIME)
+        index.add_worktime(1, date(2021, 12, 31), 3600)
+        index.add_worktime(1, date(2021, 12, 31), 1800)
+
+        rows = rows_by_day(index)
+
+        self.assertEqual(list(rows), ["2021-12-30", "2021-12-31", "2022-01-01",
+                                      "2022-01-02", "2022-01-03"])
+        # Thursday and Friday before the new workdays apply, Monday after.
+        self.assertEqual(rows["2021-12-30"]["expected_seconds"], 28800)
+        self.assertEqual(rows["2021-12-31"]["expected_seconds"], 28800)
+        self.assertEqual(rows["2022-01-01"]["expected_seconds"], 0)
+        self.assertEqual(rows["2022-01-03"]["expected_seconds"], 14400)
+        self.assertEqual(rows["2021-12-31"]["booked_seconds"], 5400)
+
+    def test_rows_stay_within_the_employment(self):
+        index = DailyWorktimeIndex(date(2021, 12, 1), date(2022, 1, 31))
+        index.add_workdays(1, date(2021, 1, 1), FULL_TIME)
+        index.add_user(1, date(2021, 12, 30), date(2022, 1, 2))
+
+        self.assertEqual(list(rows_by_day(index)),
+                         ["2021-12-30", "2021-12-31", "2022-01-01", "2022-01-02"])
+
+    def test_days_before_the_first_workdays_plan_nothing(self):
+        index = DailyWorktimeIndex(date(2021, 12, 31), date(2022, 1, 3))
+        index.add_user(1, date(2021, 12, 1), None)
+        index.add_workdays(1, date(2022, 1, 3), FULL_TIME)
+
+        rows = rows_by_day(index)
+
+        self.assertEqual(rows["2021-12-31"]["expected_seconds"], 0)
+        self.assertEqual(rows["2022-01-03"]["expected_seconds"], 28800)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Test the parsing of decimals and integers in Timebutler exports.
+"""
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from tap_timebutler import decimals  # noqa: E402
+from tap_timebutler.decimals import (set_decimal_separator, to_integer, to_integer_column,  # noqa: E402
+                                     to_number, to_number_column)
+
+
+class CommaDecimalTest(unittest.TestCase):
+
+    def test_comma_is_the_decimal_separator(self):
+        self.assertEqual(to_number("0,5"), 0.5)
+        self.assertEqual(to_number("8"), 8.0)
+        self.assertEqual(to_number("-1,25"), -1.25)
+
+    def test_dot_groups_the_thousands(self):
+        self.assertEqual(to_number("1.500"), 1500.0)
+        self.assertEqual(to_number("1.234,5"), 1234.5)
+        self.assertEqual(to_number("1.234.567,89"), 1234567.89)
+
+    def test_empty_values_stay_empty(self):
+        self.assertIsNone(to_number(None))
+        self.assertIsNone(to_integer(None))
+
+    def test_integers(self):
+        self.assertEqual(to_integer("25200"), 25200)
+        self.assertEqual(to_integer("-3600"), -3600)
+        self.assertEqual(to_integer("25.200"), 25200)
+
+    def test_decimals_are_not_integers(self):
+        with self.assertRaises(ValueError):
+            to_integer("0,5")
+
+    def test_columns(self):
+        self.assertEqual(to_number_column(["0,5", None, "1.500"]), [0.5, None, 1500.0])
+        self.assertEqual(to_integer_column(["1", None, "2"]), [1, None, 2])
+        self.assertEqual(to_integer_column(["1", None, "1.000"]), [1, None, 1000])
+
+
+class DotDecimalTest(unittest.TestCase):
+
+    def setUp(self):
+        set_decimal_separator(".")
+        self.addCleanup(set_decimal_separator, ",")
+
+    def test_dot_is_the_decimal_separator(self):
+        self.assertEqual(to_number("1.500"), 1.5)
+        self.assertEqual(to_number("1,234.5"), 1234.5)
+        self.assertEqual(to_integer("25,200"), 25200)
+
+    def test_cached_values_follow_the_separator(self):
+        set_decimal_separator(",")
+        self.assertEqual(to_number("1.5"), 15.0)
+
+        set_decimal_separator(".")
+        self.assertEqual(to_number("1.5"), 1.5)
+
+    def test_unknown_separator_is_rejected(self):
+        with self.assertRaises(ValueError):
+            set_decimal_separator(";")
+
+        self.assertEqual(decimals.DECIMAL_SEPARATOR, ".")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Test the hedging threshold of the LatencyTracker and that the first
+response of a hedged request wins.
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from tap_timebutler.hedging import PERSISTED_SAMPLES, WINDOW, Hedger, LatencyTracker  # noqa: E402
+
+
+class Response:
+    def __init__(self, name):
+        self.name = name
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def tracker_with(samples, percentile=90, min_samples=1, fallback=None):
+    tracker = LatencyTracker(percentile, min_samples, fallback)
+    for seconds in samples:
+        tracker.add("absences", seconds)
+
+    return tracker
+
+
+class LatencyTrackerTest(unittest.TestCase):
+
+    def test_too_few_samples_use_the_fallback(self):
+        self.assertIsNone(tracker_with([1, 2], min_samples=3).threshold("absences"))
+        self.assertEqual(tracker_with([1, 2], min_samples=3, fallback=5).threshold("absences"), 5)
+
+    def test_threshold_is_the_percentile_of_the_samples(self):
+        samples = [10, 1, 9, 2, 8, 3, 7, 4, 6, 5]
+
+        self.assertEqual(tracker_with(samples, percentile=90).threshold("absences"), 9)
+        self.assertEqual(tracker_with(samples, percentile=95).threshold("absences"), 10)
+        self.assertEqual(tracker_with(samples, percentile=50).threshold("absences"), 5)
+        self.assertEqual(tracker_with(samples, percentile=0).threshold("absences"), 1)
+
+    def test_endpoints_are_tracked_apart(self):
+        tracker = tracker_with([1, 1, 1], min_samples=3, fallback=5)
+
+        self.assertEqual(tracker.threshold("absences"), 1)
+        self.assertEqual(tracker.threshold("worktime"), 5)
+
+    def test_only_the_recent_samples_count(self):
+        tracker = tracker_with([100] * WINDOW + [1] * WINDOW, percentile=100)
+
+        self.assertEqual(tracker.threshold("absences"), 1)
+
+    def test_stored_samples_are_loaded(self):
+        stored = tracker_with(range(2 * PERSISTED_SAMPLES)).dump()
+        tracker = tracker_with([], min_samples=PERSISTED_SAMPLES, percentile=0)
+        tracker.load(stored)
+
+        self.assertEqual(len(stored["absences"]), PERSISTED_SAMPLES)
+        self.assertEqual(tracker.threshold("absences"), PERSISTED_SAMPLES)
+
+
+class HedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hedger = Hedger(90, min_samples=20, fallback=0.05)
+        self.addCleanup(self.hedger.close)
+
+    def test_without_a_threshold_requests_are_not_hedged(self):
+        hedger = Hedger(90, min_samples=20)
+        self.addCleanup(hedger.close)
+        calls = []
+
+        response = hedger.send("absences", lambda: calls.append(1) or Response("only"))
+
+        self.assertEqual(response.name, "only")
+        self.assertEqual(len(calls), 1)
+
+    def test_a_fast_response_is_not_hedged(self):
+        calls = []
+
+        response = self.hedger.send("absences", lambda: calls.append(1) or Response("fast"))
+
+        self.assertEqual(response.name, "fast")
+        self.assertEqual(len(calls), 1)
+
+    def test_the_first_response_wins_and_the_other_is_closed(self):
+        release = threading.Event()
+        slow = Response("slow")
+        responses = iter([slow, Response("hedge")])
+
+        def send():
+            response = next(responses)
+            if response is slow:
+                release.wait(5)
+            return response
+
+        response = self.hedger.send("absences", send)
+        release.set()
+
+        self.assertEqual(response.name, "hedge")
+        self.assertTrue(slow.closed.wait(5))
+
+    def test_a_failed_attempt_loses_to_a_response(self):
+        attempts = iter(["fail", "hedge"])
+
+        def send():
+            if next(attempts) == "fail":
+                time.sleep(0.1)
+                raise ConnectionError("reset")
+            return Response("hedge")
+
+        self.assertEqual(self.hedger.send("absences", send).name, "hedge")
+
+    def test_both_attempts_failing_raises(self):
+        def send():
+            time.sleep(0.1)
+            raise ConnectionError("reset")
+
+        with self.assertRaises(ConnectionError):
+            self.hedger.send("absences", send)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Test the memory bounded pipeline keeps peak RSS flat as the number of
+synced years and exported rows grows.
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs one sync in a fresh interpreter so ru_maxrss is the peak of this
+# sync alone. The export is generated lazily behind a fake socket, so the
+# only way for memory to grow with the row count is the tap buffering it.
+CHILD = """
+import os
+import resource
+import sys
+
+import requests
+
+import tap_timebutler as tap
+
+ROWS, YEARS = int(sys.argv[1]), int(sys.argv[2])
+
+
+class LazyBody:
+    def __init__(self, lines):
+        self._lines = lines
+        self._pending = b""
+
+    def read(self, amt=None, **kwargs):
+        parts = [self._pending]
+        size = len(self._pending)
+
+        while amt is None or size < amt:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line.encode("utf-8"))
+            size += len(parts[-1])
+
+        data = b"".join(parts)
+        if amt is None:
+            amt = len(data)
+
+        chunk, self._pending = data[:amt], data[amt:]
+        return chunk
+
+
+def absence_lines():
+    yield "header\\n"
+    for i in range(ROWS):
+        yield "{};01/03/2021;01/03/2021;false;false;{};E{};Vacation;false;Approved;;1;8;;;\\n".format(i + 1, i % 50, i)
+
+
+def worktime_lines():
+    yield "header\\n"
+    for i in range(ROWS):
+        yield "{};{};01/03/2021;09:00;17:00;25200;3600;Done;1;2;Comment {}\\n".format(i + 1, i % 50, i)
+
+
+def fake_request(url, params={}, headers={}, stream=False):
+    resp = requests.Response()
+    resp.status_code = 200
+    lines = absence_lines() if url.endswith("absences") else worktime_lines()
+    resp.raw = LazyBody(lines)
+    return resp
+
+
+tap.request = fake_request
+tap.CONFIG.update({"memory_bounded": True, "max_in_flight_records": 100})
+tap.AUTH = tap.Auth("token")
+
+sys.stdout = open(os.devnull, "w")
+
+for year in range(2021 - YEARS, 2021):
+    tap.sync_absences("absences", {"year": year})
+tap.sync_endpoint("worktime")
+
+sys.stderr.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+"""
+
+# ru_maxrss is reported in kilobytes on Linux.
+MAX_GROWTH_KB = 8 * 1024
+
+
+def peak_rss_kb(rows, years):
+    result = subprocess.run([sys.executable, "-c", CHILD, str(rows), str(years)],
+                            cwd=PACKAGE_DIR,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    return int(result.stderr.strip().splitlines()[-1])
+
+
+class MemoryBoundedTest(unittest.TestCase):
+    """Test peak memory does not grow with the size of the history"""
+
+    def test_flat_with_row_count(self):
+        small = peak_rss_kb(rows=2000, years=1)
+        large = peak_rss_kb(rows=60000, years=1)
+
+        self.assertLess(large - small, MAX_GROWTH_KB)
+
+    def test_flat_with_year_count(self):
+        small = peak_rss_kb(rows=2000, years=1)
+        large = peak_rss_kb(rows=2000, years=12)
+
+        self.assertLess(large - small, MAX_GROWTH_KB)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Test the order in which the Prefetcher starts and hands out requests, and
+that closing it cancels the requests not taken.
+"""
+import os
+import sys
+import unittest
+from concurrent.futures import Future
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+from tap_timebutler.prefetch import Prefetcher  # noqa: E402
+
+
+class RecordingExecutor:
+    """Runs submitted jobs when asked to, so the tests see what started."""
+
+    def __init__(self, run=True):
+        self.run = run
+        self.submitted = []
+
+    def submit(self, fetch):
+        future = Future()
+        self.submitted.append(future)
+        if self.run:
+            future.set_result(fetch())
+
+        return future
+
+
+def make_jobs(keys, started):
+    def fetch(key):
+        started.append(key)
+        return "response " + key
+
+    return [(key, lambda key=key: fetch(key)) for key in keys]
+
+
+class PrefetcherTest(unittest.TestCase):
+
+    def test_responses_are_handed_out_in_order(self):
+        started = []
+        prefetcher = Prefetcher(RecordingExecutor(), make_jobs("abcd", started), depth=1)
+
+        self.assertEqual([prefetcher.take(key) for key in "abcd"],
+                         ["response a", "response b", "response c", "response d"])
+        self.assertEqual(started, list("abcd"))
+
+    def test_only_depth_requests_run_ahead(self):
+        started = []
+        prefetcher = Prefetcher(RecordingExecutor(), make_jobs("abcde", started), depth=2)
+
+        prefetcher.take("a")
+
+        self.assertEqual(started, list("abc"))
+        self.assertEqual(list(prefetcher.futures), list("bc"))
+
+    def test_a_key_taken_out_of_order_keeps_the_others(self):
+        started = []
+        prefetcher = Prefetcher(RecordingExecutor(), make_jobs("abc", started), depth=1)
+
+        self.assertEqual(prefetcher.take("b"), "response b")
+        self.assertEqual(prefetcher.take("a"), "response a")
+        self.assertEqual(prefetcher.take("c"), "response c")
+
+    def test_a_key_that_was_not_prefetched_returns_none(self):
+        prefetcher = Prefetcher(RecordingExecutor(), make_jobs("ab", []), depth=1)
+
+        self.assertIsNone(prefetcher.take("z"))
+        self.assertEqual(prefetcher.take("a"), "response a")
+
+    def test_close_cancels_the_requests_not_taken(self):
+        executor = RecordingExecutor(run=False)
+        prefetcher = Prefetcher(executor, make_jobs("abcd", []), depth=2)
+        prefetcher.fill(3)
+
+        prefetcher.close()
+
+        self.assertTrue(all(future.cancelled() for future in executor.submitted))
+        self.assertEqual(len(executor.submitted), 3)
+        self.assertIsNone(prefetcher.take("d"))
+        self.assertEqual(len(executor.submitted), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
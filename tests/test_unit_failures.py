@@ -0,0 +1,122 @@
+"""
+Test the retries of failing units with max_failed_units set, and that
+failed years are synced again by the next run.
+"""
+import os
+import sys
+import unittest
+from datetime import date
+from unittest import mock
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import tap_timebutler as tap  # noqa: E402
+
+TODAY = date(2024, 6, 1)
+
+
+def failing(times):
+    """Fails the first `times` calls, then succeeds."""
+    return mock.Mock(side_effect=[ValueError("bad row")] * times + [None])
+
+
+class SyncUnitRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        tap.CONFIG.clear()
+        tap.STATE.clear()
+
+        patcher = mock.patch.object(tap, "write_state")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(tap.STATE.clear)
+        self.addCleanup(tap.CONFIG.clear)
+
+    def test_failures_raise_without_max_failed_units(self):
+        sync = failing(1)
+
+        with self.assertRaises(ValueError):
+            tap.sync_unit("absences", 2021, sync)
+
+        self.assertEqual(sync.call_count, 1)
+        self.assertNotIn("failed_units", tap.STATE)
+
+    def test_a_unit_is_retried_until_it_completes(self):
+        tap.CONFIG.update(max_failed_units=0, unit_retries=2)
+        sync = failing(2)
+
+        with self.assertLogs(tap.LOGGER, "WARNING"):
+            tap.sync_unit("absences", 2021, sync)
+
+        self.assertEqual(sync.call_count, 3)
+        self.assertTrue(tap.is_unit_completed("absences", 2021))
+        self.assertEqual(tap.get_failed_units(), 0)
+
+    def test_a_unit_failing_every_attempt_is_given_up(self):
+        tap.CONFIG.update(max_failed_units=1, unit_retries=1)
+        sync = failing(2)
+
+        with self.assertLogs(tap.LOGGER, "WARNING"):
+            tap.sync_unit("absences", 2021, sync)
+
+        self.assertEqual(sync.call_count, 2)
+        self.assertFalse(tap.is_unit_completed("absences", 2021))
+        self.assertEqual(tap.STATE["failed_units"], {"absences": ["2021"]})
+
+    def test_a_failed_unit_is_counted_once(self):
+        tap.CONFIG.update(max_failed_units=5)
+
+        with self.assertLogs(tap.LOGGER, "WARNING"):
+            tap.sync_unit("absences", 2021, failing(1))
+            tap.sync_unit("absences", 2021, failing(1))
+            tap.sync_unit("worktime", 2021, failing(1))
+
+        self.assertEqual(tap.get_failed_units(), 2)
+        self.assertEqual(tap.get_failed_units(exclude="worktime"), 1)
+
+    def test_a_completed_retry_clears_the_failure(self):
+        tap.CONFIG.update(max_failed_units=5)
+        tap.STATE["failed_units"] = {"absences": ["2021"], "worktime": ["2021"]}
+
+        tap.sync_unit("absences", 2021, mock.Mock())
+
+        self.assertEqual(tap.STATE["failed_units"], {"worktime": ["2021"]})
+
+        tap.sync_unit("worktime", 2021, mock.Mock())
+
+        self.assertNotIn("failed_units", tap.STATE)
+
+
+class SyncYearsTest(unittest.TestCase):
+
+    def setUp(self):
+        tap.CONFIG.clear()
+        tap.STATE.clear()
+        tap.CONFIG["start_date"] = "2020-01-01T00:00:00Z"
+        self.addCleanup(tap.STATE.clear)
+        self.addCleanup(tap.CONFIG.clear)
+
+    def test_years_run_from_the_start_date(self):
+        self.assertEqual(tap.get_sync_years("absences", TODAY), [2020, 2021, 2022, 2023, 2024])
+
+    def test_years_start_with_the_earliest_employment(self):
+        tap.STATE["earliest_employment"] = "2022-03-01"
+
+        self.assertEqual(tap.get_sync_years("absences", TODAY), [2022, 2023, 2024])
+
+    def test_failed_years_are_synced_again(self):
+        tap.STATE["earliest_employment"] = "2023-03-01"
+        tap.STATE["failed_units"] = {"absences": ["2021", "2023"], "worktime": ["2020"]}
+
+        self.assertEqual(tap.get_sync_years("absences", TODAY), [2021, 2023, 2024])
+
+    def test_a_failed_unit_without_a_year_adds_none(self):
+        tap.STATE["earliest_employment"] = "2023-03-01"
+        tap.STATE["failed_units"] = {"absences": ["all"]}
+
+        self.assertEqual(tap.get_sync_years("absences", TODAY), [2023, 2024])
+
+
+if __name__ == "__main__":
+    unittest.main()